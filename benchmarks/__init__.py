@@ -0,0 +1 @@
+# Benchmarks and local harnesses. Run from the project root: python -m benchmarks.<name>
@@ -0,0 +1,156 @@
+import argparse
+import io
+import queue
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.samples import make_fb2, make_rar
+from src.archive_handler import ArchiveHandler
+from src.archive_tools import find_7z, find_unrar, rar_is_solid
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def build_books(count: int, paragraphs: int) -> List[Tuple[str, bytes]]:
+    return [(f"series/book{i:03d}.fb2", make_fb2(f"Книга {i}", paragraphs, "Серия", i)) for i in range(count)]
+
+
+def write_zip(path: Path, books: List[Tuple[str, bytes]]):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in books:
+            archive.writestr(name, data)
+
+
+def write_nested_zip(path: Path, books: List[Tuple[str, bytes]]):
+    # Так серии обычно раздают библиотеки: каждая книга в своём .fb2.zip
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        for name, data in books:
+            inner = io.BytesIO()
+            with zipfile.ZipFile(inner, 'w', zipfile.ZIP_DEFLATED) as book_archive:
+                book_archive.writestr(Path(name).name, data)
+            archive.writestr(f"{name}.zip", inner.getvalue())
+
+
+def tar_writer(mode: str) -> Callable[[Path, List[Tuple[str, bytes]]], None]:
+    def write(path: Path, books: List[Tuple[str, bytes]]):
+        with tarfile.open(path, mode) as archive:
+            for name, data in books:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+    return write
+
+
+def tool_writer(args: Callable[[Path], List[str]]) -> Callable[[Path, List[Tuple[str, bytes]]], None]:
+    def write(path: Path, books: List[Tuple[str, bytes]]):
+        with tempfile.TemporaryDirectory() as source:
+            for name, data in books:
+                target = Path(source) / name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_bytes(data)
+            subprocess.run(args(path), cwd=source, check=True, capture_output=True)
+    return write
+
+
+def rar_writer(solid: bool) -> Callable[[Path, List[Tuple[str, bytes]]], None]:
+    def write(path: Path, books: List[Tuple[str, bytes]]):
+        path.write_bytes(make_rar(books, solid))
+    return write
+
+
+def check_rar_headers():
+    # Заголовки читает установленный rarfile, unrar для этого не нужен
+    import rarfile
+    for solid in (False, True):
+        with rarfile.RarFile(io.BytesIO(make_rar([("book.fb2", make_fb2("Книга", 10))], solid))) as archive:
+            if rar_is_solid(archive) != solid or archive.namelist() != ["book.fb2"]:
+                raise RuntimeError(f"RAR (solid={solid}): заголовки прочитаны неверно")
+
+
+def available_formats() -> Dict[str, Tuple[str, Callable]]:
+    formats = {
+        'zip': ('.zip', write_zip),
+        'fb2.zip in zip': ('.zip', write_nested_zip),
+        'tar': ('.tar', tar_writer('w')),
+        'tar.gz': ('.tar.gz', tar_writer('w:gz')),
+        'tar.bz2': ('.tar.bz2', tar_writer('w:bz2')),
+        'tar.xz': ('.tar.xz', tar_writer('w:xz')),
+    }
+    if find_7z():
+        formats['7z'] = ('.7z', tool_writer(lambda path: [find_7z(), 'a', '-bd', str(path), '.']))
+    if shutil.which('rar'):
+        formats['rar'] = ('.rar', tool_writer(lambda path: ['rar', 'a', '-r', '-idq', str(path), '.']))
+    if find_unrar():
+        # Без WinRAR архивы собираются без сжатия: проверяется путь через unrar, а не скорость распаковки
+        formats['rar stored'] = ('.rar', rar_writer(False))
+        formats['rar solid stored'] = ('.rar', rar_writer(True))
+    return formats
+
+
+def parse_file(handler: ArchiveHandler, path: Path) -> int:
+    books, _ = handler.extract_and_parse_file(str(path), 0)
+    return len(books)
+
+
+def parse_tar_stream(handler: ArchiveHandler, path: Path) -> int:
+    # Как при загрузке: куски ложатся в очередь, архив разбирается по мере поступления
+    chunks: queue.Queue = queue.Queue()
+    with open(path, 'rb') as f:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            chunks.put(chunk)
+    chunks.put(None)
+    return len(handler.parse_archive_chunks(chunks, path.name))
+
+
+def measure(func: Callable[[], int], repeat: int) -> Tuple[float, int]:
+    best: Optional[float] = None
+    books = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        books = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, books
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest throughput per archive format")
+    parser.add_argument("--books", type=int, default=40)
+    parser.add_argument("--paragraphs", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    check_rar_headers()
+    books = build_books(args.books, args.paragraphs)
+    unpacked_mb = sum(len(data) for _, data in books) / (1024 * 1024)
+    handler = ArchiveHandler()
+    print(f"books={args.books} unpacked={unpacked_mb:.1f} MB, best of {args.repeat}")
+    print(f"{'format':<16} {'archive MB':>10} {'seconds':>8} {'MB/s':>8} {'books/s':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, (suffix, writer) in available_formats().items():
+            path = Path(tmp) / f"bench-{label.replace(' ', '_')}{suffix}"
+            writer(path, books)
+            archive_mb = path.stat().st_size / (1024 * 1024)
+
+            runs = [(label, lambda path=path: parse_file(handler, path))]
+            if suffix.startswith('.tar'):
+                runs.append((f"{label} stream", lambda path=path: parse_tar_stream(handler, path)))
+
+            for run_label, func in runs:
+                elapsed, parsed = measure(func, args.repeat)
+                if parsed != args.books:
+                    print(f"{run_label:<16} parsed {parsed} of {args.books} books")
+                    continue
+                print(f"{run_label:<16} {archive_mb:10.1f} {elapsed:8.2f} "
+                      f"{unpacked_mb / elapsed:8.1f} {parsed / elapsed:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
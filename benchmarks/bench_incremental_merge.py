@@ -0,0 +1,58 @@
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from benchmarks.samples import make_fb2
+from src.archive_handler import ArchiveHandler
+from src.fb2_merger import FB2Merger
+from src.models import BookContent
+from src.spool import Spool
+
+
+def parse_books(handler: ArchiveHandler, spool: Spool, start: int, count: int, paragraphs: int) -> List[BookContent]:
+    return [
+        handler.parse_fb2_bytes(make_fb2(f"Книга {i}", paragraphs, "Серия", i, image_size=64 * 1024), f"book{i}.fb2", spool)
+        for i in range(start, start + count)
+    ]
+
+
+def timed(label: str, func: Callable[[], bool], output: Path):
+    started = time.perf_counter()
+    if not func():
+        raise RuntimeError(f"{label}: слияние не удалось")
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed:8.3f} s {output.stat().st_size / (1024 * 1024):8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold merge versus re-merge from cached book segments")
+    parser.add_argument("--books", type=int, default=40)
+    parser.add_argument("--added", type=int, default=2)
+    parser.add_argument("--paragraphs", type=int, default=4000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = Spool(Path(tmp) / "spool")
+        handler = ArchiveHandler()
+        merger = FB2Merger()
+        output = Path(tmp) / "merged.fb2"
+
+        books = parse_books(handler, spool, 0, args.books, args.paragraphs)
+        timed(f"cold, {len(books)} books", lambda: merger.create_merged_fb2(books, str(output), spool=spool), output)
+        timed("unchanged", lambda: merger.create_merged_fb2(books, str(output), spool=spool), output)
+
+        books += parse_books(handler, spool, args.books, args.added, args.paragraphs)
+        timed(f"+{args.added} books", lambda: merger.create_merged_fb2(books, str(output), spool=spool), output)
+
+        random.Random(1).shuffle(books)
+        timed("reordered", lambda: merger.create_merged_fb2(books, str(output), spool=spool), output)
+        timed("renamed", lambda: merger.create_merged_fb2(books, str(output), "Другое название", spool), output)
+
+        spool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import io
+import itertools
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+os.environ.setdefault('BOT_TOKEN', '42:FAKE')
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+from benchmarks.bench_merge_assembly import current_rss, peak_rss, reset_peak_rss
+from benchmarks.fake_telegram import FakeTelegramAPI
+from benchmarks.samples import make_fb2
+from config.config import Config
+from src.bot import bot_data, create_status_message, get_main_inline_keyboard, get_workspace, router
+from src.loop_monitor import LoopLagMonitor
+from src.metrics import HandlerTimingMiddleware
+from src.send_queue import SendQueue
+from src.status_updater import StatusUpdater
+
+ACTIONS = ('upload', 'list', 'sort', 'auto_sort', 'rename', 'merge', 'clear')
+
+
+def make_archive(user_id: int, archive: int, books: int, paragraphs: int, image_size: int) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for i in range(books):
+            number = archive * books + i + 1
+            zf.writestr(f"book{number}.fb2", make_fb2(f"Книга {number} ({user_id})", paragraphs, "Серия", number,
+                                                      image_size=image_size))
+    return buffer.getvalue()
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LoadTest:
+    # Обновления подаются через dp.feed_update, как при вебхуке: каждое обрабатывается своей задачей,
+    # а все вызовы Bot API (загрузка файлов, ответы, статус) идут по HTTP в локальный фейковый сервер
+    def __init__(self, api: FakeTelegramAPI, bot: Bot, dp: Dispatcher):
+        self.api = api
+        self.bot = bot
+        self.dp = dp
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._ids = itertools.count(1)
+
+    def _update(self, user_id: int, **message) -> Update:
+        update_id = next(self._ids)
+        payload = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        }
+        payload.update(message)
+        return Update.model_validate({"update_id": update_id, "message": payload}, context={"bot": self.bot})
+
+    async def _send(self, action: str, update: Update):
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            self.errors[action] += 1
+        self.latencies[action].append(time.perf_counter() - started)
+
+    async def text(self, action: str, user_id: int, text: str):
+        await self._send(action, self._update(user_id, text=text))
+
+    async def upload(self, user_id: int, file_id: str):
+        size = len(self.api.files[file_id])
+        await self._send('upload', self._update(user_id, document={
+            "file_id": file_id, "file_unique_id": file_id, "file_name": f"{file_id}.zip", "file_size": size
+        }))
+
+    async def user_session(self, user_id: int, file_ids: List[str], total_books: int, delay: float):
+        await asyncio.sleep(delay)
+        # Архивы пользователь кидает пачкой, дальше действия идут по одному, как в чате
+        await asyncio.gather(*(self.upload(user_id, file_id) for file_id in file_ids))
+        await self.text('list', user_id, "📋 Список книг")
+        await self.text('sort', user_id, "📝 Сортировать книги")
+        await self.text('sort', user_id, " ".join(str(i) for i in range(total_books, 0, -1)))
+        await self.text('auto_sort', user_id, "🔢 Авто-сортировка")
+        await self.text('rename', user_id, "✏️ Назвать сборник")
+        await self.text('rename', user_id, f"Сборник {user_id}")
+        await self.text('merge', user_id, "📚 Слить книги")
+        await self.text('clear', user_id, "🗑️ Очистить сессию")
+
+
+async def run(args) -> None:
+    api = FakeTelegramAPI(chat_rate=args.chat_rate, chat_burst=int(args.chat_rate), global_rate=args.global_rate,
+                          latency=args.api_latency)
+    await api.start()
+    bot = api.create_bot()
+    send_queue = SendQueue(global_rate=args.global_rate, chat_rate=args.chat_rate, chat_burst=args.chat_rate)
+    bot.session.middleware(send_queue)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = Config()
+        config.TEMP_DIR = Path(tmp)
+        config.bot = bot
+        bot_data.config = config
+        bot_data.bot_instance = bot
+        bot_data.send_queue = send_queue
+        bot_data.status_updater = StatusUpdater(bot, bot_data.sessions, create_status_message,
+                                                get_main_inline_keyboard, delay=config.STATUS_DEBOUNCE_SECONDS,
+                                                min_interval=config.STATUS_MIN_INTERVAL_SECONDS)
+        await get_workspace().reconcile()
+
+        dp = Dispatcher(storage=MemoryStorage())
+        timing = HandlerTimingMiddleware(bot_data.metrics)
+        dp.message.middleware(timing)
+        dp.callback_query.middleware(timing)
+        dp.include_router(router)
+
+        users = list(range(10_000, 10_000 + args.users))
+        uploaded = 0
+        files: Dict[int, List[str]] = {}
+        for user_id in users:
+            files[user_id] = []
+            for archive in range(args.archives):
+                data = make_archive(user_id, archive, args.books, args.paragraphs, args.image_kb * 1024)
+                files[user_id].append(api.add_file(f"u{user_id}_a{archive}", data))
+                uploaded += len(data)
+
+        loop_monitor = LoopLagMonitor(config.LOOP_LAG_THRESHOLD, histogram=bot_data.metrics.loop_lag)
+        bot_data.loop_monitor = loop_monitor
+        load = LoadTest(api, bot, dp)
+
+        reset_peak_rss()
+        baseline = current_rss()
+        loop_monitor.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            load.user_session(user_id, files[user_id], args.archives * args.books, args.ramp * i / args.users)
+            for i, user_id in enumerate(users)
+        ))
+        elapsed = time.perf_counter() - started
+        await loop_monitor.stop()
+        peak = peak_rss()
+
+        await get_workspace().drain()
+        await send_queue.close()
+        await bot.session.close()
+        await api.stop()
+
+    merged = sum(1 for user_id in users for item in api.delivered[user_id] if item['method'] == 'sendDocument')
+    actions = sum(len(values) for values in load.latencies.values())
+    print(f"{args.users} users x {args.archives} archives x {args.books} books, "
+          f"{uploaded / 2**20:.1f} MB uploaded in {elapsed:.2f} s")
+    print(f"throughput: {actions / elapsed:.1f} updates/s, {uploaded / 2**20 / elapsed:.1f} MB/s ingested, "
+          f"{merged}/{args.users} merged files delivered")
+    print(f"{'action':<10} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for action in ACTIONS:
+        values = load.latencies.get(action)
+        if not values:
+            continue
+        print(f"{action:<10} {len(values):6d} {load.errors[action]:6d} {percentile(values, 0.5) * 1000:8.1f} "
+              f"{percentile(values, 0.95) * 1000:8.1f} {percentile(values, 0.99) * 1000:8.1f} "
+              f"{max(values) * 1000:8.1f}")
+
+    lag = bot_data.metrics.loop_lag.snapshot()
+    lock_wait = bot_data.metrics.lock_wait.snapshot()
+    print(f"loop lag: p99 {lag['p99'] * 1000:.1f} ms, max {lag['max'] * 1000:.1f} ms, "
+          f"{loop_monitor.stalls} stalls over {config.LOOP_LAG_THRESHOLD * 1000:.0f} ms")
+    print(f"lock wait: p95 {lock_wait['p95'] * 1000:.1f} ms, max {lock_wait['max'] * 1000:.1f} ms")
+    print(f"peak RSS: {peak / 2**20:.0f} MB ({(peak - baseline) / 2**20:+.0f} MB over baseline), "
+          f"Bot API calls: {sum(api.calls.values())}, 429s: {api.flood_errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated users driving the bot router against a fake Bot API")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--archives", type=int, default=2, help="zip archives uploaded per user")
+    parser.add_argument("--books", type=int, default=5, help="books per archive")
+    parser.add_argument("--paragraphs", type=int, default=1000)
+    parser.add_argument("--image-kb", type=int, default=64)
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which users arrive")
+    parser.add_argument("--chat-rate", type=float, default=30.0, help="fake API per-chat limit, messages/s")
+    parser.add_argument("--global-rate", type=float, default=1000.0)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds added to every Bot API call")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
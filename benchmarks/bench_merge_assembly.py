@@ -0,0 +1,145 @@
+import argparse
+import ctypes
+import os
+import pickle
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from lxml import etree
+
+from benchmarks.samples import make_fb2
+from src.archive_handler import ArchiveHandler
+from src.fb2_merger import FICTIONBOOK_OPEN, FB2Merger
+from src.models import BookContent
+from src.spool import Spool
+from src.xml_parsers import get_parser
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def current_rss() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def reset_peak_rss():
+    # Свободная куча родителя досталась потомку уже резидентной и скрыла бы новые выделения
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    # Потомок после fork наследует пик RSS родителя; "5" в clear_refs сбрасывает VmHWM (Linux 4.0+)
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+def peak_rss() -> int:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def segment_bytes(book: BookContent, start: int, end: int) -> bytes:
+    payload = book.segment.payload
+    with open(payload.path, 'rb') as f:
+        return os.pread(f.fileno(), end - start, payload.offset + start)
+
+
+def merge_legacy_tree(books: List[BookContent], output_path: str):
+    # Как было до сегментов: весь документ собирается деревом в памяти и пишется tree.write
+    parser = get_parser()
+    root = etree.fromstring(FICTIONBOOK_OPEN + b'</FictionBook>', parser)
+    root.append(FB2Merger()._build_description("Сборник", books))
+    body = etree.SubElement(root, '{http://www.gribuser.ru/xml/fictionbook/2.0}body')
+    for book in books:
+        body.append(etree.fromstring(segment_bytes(book, 0, book.segment.section_length), parser))
+    for book in books:
+        binaries = segment_bytes(book, book.segment.section_length, book.segment.length)
+        root.extend(etree.fromstring(b'<root>' + binaries + b'</root>', parser))
+
+    with open(output_path, 'wb') as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        etree.ElementTree(root).write(f, encoding='utf-8', pretty_print=True, xml_declaration=False)
+
+
+def merge_buffered(books: List[BookContent], output_path: str):
+    # Сегменты читаются в bytes и пишутся обратно: два копирования через память процесса
+    with open(output_path, 'wb') as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n' + FICTIONBOOK_OPEN)
+        f.write(etree.tostring(FB2Merger()._build_description("Сборник", books), encoding='utf-8'))
+        f.write(b'<body>\n')
+        for book in books:
+            f.write(segment_bytes(book, 0, book.segment.section_length))
+        f.write(b'</body>\n')
+        for book in books:
+            f.write(segment_bytes(book, book.segment.section_length, book.segment.length))
+        f.write(b'</FictionBook>\n')
+
+
+def merge_zero_copy(books: List[BookContent], output_path: str):
+    if not FB2Merger().create_merged_fb2(books, output_path, "Сборник"):
+        raise RuntimeError("слияние не удалось")
+
+
+def run_forked(func: Callable[[List[BookContent], str], None], books: List[BookContent], output_path: str) -> dict:
+    # Каждый способ в своём процессе, иначе пик RSS одного маскирует другие
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        reset_peak_rss()
+        baseline = current_rss()
+        started = time.perf_counter()
+        func(books, output_path)
+        result = {'seconds': time.perf_counter() - started, 'rss': peak_rss() - baseline,
+                  'size': os.path.getsize(output_path)}
+        with os.fdopen(write_fd, 'wb') as pipe:
+            pickle.dump(result, pipe)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    os.unlink(output_path)
+    return pickle.loads(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merged FB2 assembly: tree.write versus zero-copy segments")
+    parser.add_argument("--size-mb", type=int, default=1024, help="approximate size of the merged file")
+    parser.add_argument("--books", type=int, default=64)
+    parser.add_argument("--paragraphs", type=int, default=4000)
+    args = parser.parse_args()
+
+    # Основной объём - картинки: в base64 они вырастают на треть
+    image_size = max(16 * 1024, args.size_mb * 1024 * 1024 * 3 // 4 // args.books)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = Spool(Path(tmp) / "spool")
+        handler = ArchiveHandler()
+        started = time.perf_counter()
+        books = [
+            handler.parse_fb2_bytes(make_fb2(f"Книга {i}", args.paragraphs, "Серия", i, image_size=image_size),
+                                    f"book{i}.fb2", spool)
+            for i in range(args.books)
+        ]
+        spool.close()
+        print(f"ingest {args.books} books: {time.perf_counter() - started:.1f} s, spool {spool.size / 2**20:.0f} MB")
+        print(f"{'method':<14} {'seconds':>8} {'MB/s':>8} {'peak RSS MB':>12} {'output MB':>10}")
+
+        output_path = str(Path(tmp) / "merged.fb2")
+        for label, func in (('tree.write', merge_legacy_tree), ('read/write', merge_buffered),
+                            ('zero-copy', merge_zero_copy)):
+            result = run_forked(func, books, output_path)
+            size_mb = result['size'] / 2**20
+            print(f"{label:<14} {result['seconds']:8.2f} {size_mb / result['seconds']:8.0f} "
+                  f"{result['rss'] / 2**20:12.0f} {size_mb:10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import gc
+import os
+import tempfile
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Dict
+
+from src.models import BookContent, BookSegment, FB2Image
+from src.spool import Spool
+
+
+@dataclass
+class LegacyFB2Image:
+    id: str
+    content_type: str
+    data: bytes
+    original_ref: str
+    actual_extension: str = ""
+
+
+@dataclass
+class LegacyBookContent:
+    content: str
+    filename: str
+    title: str = "Unknown"
+    images: Dict[str, LegacyFB2Image] = field(default_factory=dict)
+    processed_content: str = ""
+    sort_order: int = 0
+    file_path: str = ""
+
+
+def build_legacy(books: int, images: int, image_size: int, body: str) -> list:
+    result = []
+    for i in range(books):
+        book = LegacyBookContent(content="", filename=f"book{i}.fb2", title=f"Книга {i}",
+                                 processed_content=body, sort_order=i)
+        for j in range(images):
+            image_id = f"img{j}.jpg"
+            book.images[image_id] = LegacyFB2Image(image_id, "image/jpeg", os.urandom(image_size),
+                                                   f"#{image_id}", ".jpg")
+        book.image_mapping = {}
+        result.append(book)
+    return result
+
+
+def build_slotted(books: int, images: int, image_size: int, body: str, spool: Spool) -> list:
+    result = []
+    for i in range(books):
+        # Тело и картинки лежат в спуле одним сегментом, у книги остаются ссылка на него и описания картинок
+        section = body.encode('utf-8')
+        data = section + b"".join(os.urandom(image_size) for _ in range(images))
+        book = BookContent(content="", filename=f"book{i}.fb2", title=f"Книга {i}", sort_order=i,
+                           segment=BookSegment(f"b{i}", len(section), len(data), payload=spool.put(data)))
+        for j in range(images):
+            image_id = f"img{j}.jpg"
+            book.images[image_id] = FB2Image(image_id, "image/jpeg", f"#{image_id}", ".jpg", size=image_size)
+        result.append(book)
+    return result
+
+
+def measure(factory) -> int:
+    gc.collect()
+    tracemalloc.start()
+    objects = factory()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-book memory footprint of BookContent/FB2Image")
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--images", type=int, default=3)
+    parser.add_argument("--image-size", type=int, default=64 * 1024)
+    parser.add_argument("--body-size", type=int, default=0,
+                        help="body text size per book; 0 measures record overhead only")
+    args = parser.parse_args()
+
+    body = "x" * args.body_size
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = Spool(tmp)
+        legacy = measure(lambda: build_legacy(args.books, args.images, args.image_size, body))
+        slotted = measure(lambda: build_slotted(args.books, args.images, args.image_size, body, spool))
+        spool.close()
+
+    print(f"books={args.books} images/book={args.images} image_size={args.image_size}")
+    print(f"legacy:  {legacy / args.books:10.0f} B/book")
+    print(f"slotted: {slotted / args.books:10.0f} B/book")
+    print(f"ratio:   {legacy / max(slotted, 1):10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import time
+
+from aiogram.types import BufferedInputFile
+
+from benchmarks.fake_telegram import FakeTelegramAPI
+from src.send_queue import SendQueue
+
+
+async def run_scenario(chats: int, messages: int, use_queue: bool) -> dict:
+    api = FakeTelegramAPI()
+    await api.start()
+    bot = api.create_bot()
+    queue = None
+    if use_queue:
+        queue = SendQueue(global_rate=25, chat_rate=1, chat_burst=3, max_retries=10)
+        bot.session.middleware(queue)
+
+    lost = 0
+    document_latency = []
+
+    async def user_traffic(chat_id: int):
+        nonlocal lost
+        status = await bot.send_message(chat_id=chat_id, text="status 0")
+        jobs = []
+        for i in range(messages):
+            jobs.append(bot.send_message(chat_id=chat_id, text=f"⏳ {i}"))
+            jobs.append(bot.edit_message_text(chat_id=chat_id, message_id=status.message_id,
+                                              text=f"status {i + 1}"))
+
+        async def send_document():
+            started = time.perf_counter()
+            await bot.send_document(chat_id=chat_id,
+                                    document=BufferedInputFile(b"x" * 4096, filename="merged.fb2"))
+            document_latency.append(time.perf_counter() - started)
+
+        jobs.append(send_document())
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        lost += sum(1 for r in results if isinstance(r, Exception))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_traffic(1000 + i) for i in range(chats)))
+    elapsed = time.perf_counter() - started
+
+    if queue:
+        await queue.close()
+    await bot.session.close()
+    await api.stop()
+
+    return {
+        "mode": "queue" if use_queue else "direct",
+        "requests": chats * (messages * 2 + 2),
+        "lost": lost,
+        "flood_429": api.flood_errors,
+        "elapsed_s": round(elapsed, 2),
+        "doc_latency_max_s": round(max(document_latency), 2) if document_latency else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Send queue vs direct calls against a fake Bot API")
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=5)
+    args = parser.parse_args()
+
+    for use_queue in (False, True):
+        result = await run_scenario(args.chats, args.messages, use_queue)
+        print(" ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# То, что src.main импортирует до начала опроса
+STARTUP_IMPORTS = (
+    "import src.main\n"
+    "from config.config import Config\n"
+    "from src.bot import router, bot_data\n"
+    "from aiogram import Bot, Dispatcher\n"
+    "from aiogram.fsm.storage.memory import MemoryStorage\n"
+    "from src.send_queue import SendQueue\n"
+    "from src.status_updater import StatusUpdater\n"
+    "from src.workers import configure_workers\n"
+)
+
+# Нижняя граница: без aiogram бот не стартует, его стоимость вычитается из бюджета
+FRAMEWORK_IMPORTS = "from aiogram import Bot, Dispatcher\n"
+
+# Модули, которые должны грузиться только при первом файле
+DEFERRED_MODULES = ("lxml", "lxml.etree", "rarfile", "imghdr", "src.archive_handler", "src.fb2_merger")
+
+
+def run_startup(extra_args: List[str], code: str = STARTUP_IMPORTS) -> Tuple[float, str]:
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "0:benchmark"))
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, *extra_args, "-c", code],
+                            cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True)
+    return time.perf_counter() - started, result.stderr
+
+
+def parse_importtime(report: str) -> List[Tuple[str, int, int]]:
+    modules = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import cost of the bot process")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=250,
+                        help="median startup cost on top of importing aiogram; exit code 1 when exceeded")
+    args = parser.parse_args()
+
+    _, report = run_startup(["-X", "importtime"])
+    modules = parse_importtime(report)
+    loaded = {name for name, _, _ in modules}
+
+    print(f"modules imported at startup: {len(modules)}")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cumulative_us in sorted(modules, key=lambda m: m[2], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+
+    eager = [name for name in DEFERRED_MODULES if name in loaded]
+    print(f"deferred modules loaded eagerly: {', '.join(eager) if eager else 'none'}")
+
+    framework = statistics.median(run_startup([], FRAMEWORK_IMPORTS)[0] * 1000 for _ in range(args.runs))
+    timings = [run_startup([])[0] * 1000 for _ in range(args.runs)]
+    median = statistics.median(timings)
+    overhead = median - framework
+    print(f"cold start: median {median:.0f} ms, min {min(timings):.0f} ms, max {max(timings):.0f} ms "
+          f"over {args.runs} runs")
+    print(f"aiogram alone: {framework:.0f} ms, bot overhead: {overhead:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    if eager or overhead > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
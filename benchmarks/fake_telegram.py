@@ -0,0 +1,155 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "BookMergeBot", "username": "book_merge_bot"}
+
+
+class FakeTelegramAPI:
+    def __init__(self, chat_rate: float = 1.0, chat_burst: int = 3, global_rate: float = 30.0,
+                 retry_after: int = 1, latency: float = 0.0):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_rate = global_rate
+        self.retry_after = retry_after
+        self.latency = latency
+
+        self.calls: Counter = Counter()
+        self.flood_errors = 0
+        self.delivered: Dict[int, List[dict]] = defaultdict(list)
+        self.files: Dict[str, bytes] = {}
+
+        self._message_ids = itertools.count(1)
+        self._chat_allowance: Dict[int, tuple] = {}
+        self._global_allowance = (float(global_rate), time.monotonic())
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    def add_file(self, file_id: str, data: bytes) -> str:
+        self.files[file_id] = data
+        return file_id
+
+    def _take(self, allowance: tuple, rate: float, burst: float) -> tuple:
+        tokens, updated = allowance
+        now = time.monotonic()
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            return None
+        return tokens - 1, now
+
+    def _flood_check(self, chat_id: Optional[int]) -> bool:
+        allowance = self._take(self._global_allowance, self.global_rate, self.global_rate)
+        if allowance is None:
+            return False
+        if chat_id is not None:
+            chat_allowance = self._chat_allowance.get(chat_id, (float(self.chat_burst), time.monotonic()))
+            chat_allowance = self._take(chat_allowance, self.chat_rate, self.chat_burst)
+            if chat_allowance is None:
+                return False
+            self._chat_allowance[chat_id] = chat_allowance
+        self._global_allowance = allowance
+        return True
+
+    def _message(self, chat_id: int, **extra) -> dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        self.calls[method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = int(form["chat_id"]) if "chat_id" in form else None
+        if method in ("sendMessage", "sendDocument", "editMessageText", "deleteMessage"):
+            if not self._flood_check(chat_id):
+                self.flood_errors += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                })
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "sendMessage":
+            result = self._message(chat_id, text=form.get("text", ""))
+            self.delivered[chat_id].append({"method": method, "text": result["text"]})
+        elif method == "editMessageText":
+            result = self._message(chat_id, text=form.get("text", ""))
+            result["message_id"] = int(form["message_id"])
+            self.delivered[chat_id].append({"method": method, "text": result["text"]})
+        elif method == "sendDocument":
+            document = next((v for v in form.values() if isinstance(v, web.FileField)), None)
+            size = len(document.file.read()) if document else 0
+            file_name = document.filename if document else "document"
+            result = self._message(chat_id, document={
+                "file_id": f"doc_{file_name}",
+                "file_unique_id": f"doc_{file_name}",
+                "file_name": file_name,
+                "file_size": size,
+            })
+            self.delivered[chat_id].append({"method": method, "file_name": file_name, "size": size})
+        elif method in ("deleteMessage", "answerCallbackQuery"):
+            result = True
+        elif method == "getFile":
+            file_id = form["file_id"]
+            if file_id not in self.files:
+                return web.json_response({"ok": False, "error_code": 400,
+                                          "description": "Bad Request: invalid file_id"})
+            result = {"file_id": file_id, "file_unique_id": file_id,
+                      "file_size": len(self.files[file_id]), "file_path": f"documents/{file_id}"}
+        elif method == "getUpdates":
+            await asyncio.sleep(min(float(form.get("timeout", 0) or 0), 1))
+            result = []
+        else:
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"})
+
+        return web.Response(text=json.dumps({"ok": True, "result": result}),
+                            content_type="application/json")
+
+    async def _handle_file(self, request: web.Request) -> web.StreamResponse:
+        file_id = request.match_info["path"].rsplit("/", 1)[-1]
+        data = self.files.get(file_id)
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=2 * 1024 ** 3)
+        app.router.add_post("/bot{token}/{method}", self._handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._handle_file)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def create_bot(self, token: str = "42:FAKE") -> Bot:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+        return Bot(token=token, session=session)
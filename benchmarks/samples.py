@@ -0,0 +1,64 @@
+import base64
+import os
+import zlib
+from typing import List, Optional, Tuple
+
+FB2_TEMPLATE = '''<?xml version="1.0" encoding="{encoding}"?>
+<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" xmlns:l="http://www.w3.org/1999/xlink">
+<description><title-info><author><first-name>{first_name}</first-name><last-name>{last_name}</last-name></author>\
+<book-title>{title}</book-title><annotation><p>Аннотация: {title}</p></annotation>{sequence}\
+<coverpage><image l:href="#cover.jpg"/></coverpage></title-info></description>
+<body><title><p>{title}</p></title><section><image l:href="#cover.jpg"/>
+{paragraphs}
+</section></body>
+<binary id="cover.jpg" content-type="image/jpeg">{cover}</binary>
+</FictionBook>
+'''
+
+
+def make_fb2(title: str, paragraphs: int = 500, series: Optional[str] = None, number: Optional[int] = None,
+             author: tuple = ("Иван", "Петров"), image_size: int = 16 * 1024, encoding: str = 'utf-8') -> bytes:
+    # Книга с предсказуемым текстом и одной "обложкой" из случайных байт
+    sequence = f'<sequence name="{series}" number="{number}"/>' if series else ''
+    body = "\n".join(
+        f"<p>Абзац {i} книги «{title}»: <emphasis>текст</emphasis> для проверки <strong>скорости</strong>.</p>"
+        for i in range(paragraphs)
+    )
+    cover = base64.b64encode(b'\xff\xd8\xff\xe0' + os.urandom(image_size)).decode('ascii')
+    return FB2_TEMPLATE.format(encoding=encoding, first_name=author[0], last_name=author[1], title=title,
+                               sequence=sequence, paragraphs=body, cover=cover).encode(encoding)
+
+
+def _vint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+def _rar5_block(header_type: int, header_flags: int, fields: bytes, data_size: Optional[int] = None) -> bytes:
+    body = _vint(header_type) + _vint(header_flags)
+    if data_size is not None:
+        body += _vint(data_size)
+    body += fields
+    header = _vint(len(body)) + body
+    return zlib.crc32(header).to_bytes(4, 'little') + header
+
+
+def make_rar(members: List[Tuple[str, bytes]], solid: bool = False) -> bytes:
+    # Настоящий RAR5 с несжатыми членами: собирается без WinRAR, читается rarfile, unrar и libarchive
+    main_flags = 0x04 if solid else 0
+    out = bytearray(b'Rar!\x1a\x07\x01\x00')
+    out += _rar5_block(1, 0, _vint(main_flags))
+    for name, data in members:
+        encoded = name.encode('utf-8')
+        # Флаги файла: только CRC32; метод 0 (хранение), поэтому solid задаётся лишь главным заголовком
+        fields = (_vint(0x04) + _vint(len(data)) + _vint(0x20) + zlib.crc32(data).to_bytes(4, 'little') +
+                  _vint(0) + _vint(0) + _vint(len(encoded)) + encoded)
+        out += _rar5_block(2, 0x02, fields, data_size=len(data))
+        out += data
+    out += _rar5_block(5, 0, _vint(0))
+    return bytes(out)
@@ -5,18 +5,36 @@ from dotenv import load_dotenv
 BASE_DIR = Path(__file__).resolve().parent.parent 
 env_path = BASE_DIR / '.env'
 
-print(f"🔍 Загружаю .env из: {env_path}")
-print(f"📁 Файл существует: {env_path.exists()}")
-
 load_dotenv(env_path, encoding='utf-8')
-print("✅ Файл .env загружен с кодировкой UTF-8")
 
 class Config:
     BOT_TOKEN = os.getenv('BOT_TOKEN')
     TEMP_DIR = BASE_DIR / "temp" 
+    STATUS_DEBOUNCE_SECONDS = float(os.getenv('STATUS_DEBOUNCE_SECONDS', '1.5'))
+    STATUS_MIN_INTERVAL_SECONDS = float(os.getenv('STATUS_MIN_INTERVAL_SECONDS', '3'))
+    TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))
+    TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+    TELEGRAM_CHAT_BURST = float(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+    TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '5'))
+    MAX_PARALLEL_UPLOADS = int(os.getenv('MAX_PARALLEL_UPLOADS', '4'))
+    PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', '0')) or None
+    SPOOL_MAX_MEMORY = int(os.getenv('SPOOL_MAX_MEMORY_MB', '16')) * 1024 * 1024
+    ARCHIVE_WORKERS = int(os.getenv('ARCHIVE_WORKERS', '4'))
+    EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', '4'))
+    IO_WORKERS = int(os.getenv('IO_WORKERS', '4'))
+    STREAM_WORKERS = int(os.getenv('STREAM_WORKERS', '16'))
+    MERGE_WORKERS = int(os.getenv('MERGE_WORKERS', '2'))
+    ARCHIVE_MAX_DEPTH = int(os.getenv('ARCHIVE_MAX_DEPTH', '3'))
+    ARCHIVE_MAX_RATIO = float(os.getenv('ARCHIVE_MAX_RATIO', '100'))
+    ARCHIVE_MAX_UNPACKED = int(os.getenv('ARCHIVE_MAX_UNPACKED_MB', '1024')) * 1024 * 1024
+    WORKSPACE_MAX_BYTES = int(os.getenv('WORKSPACE_MAX_MB', '10240')) * 1024 * 1024
+    WORKSPACE_USER_MAX_BYTES = int(os.getenv('WORKSPACE_USER_MAX_MB', '2048')) * 1024 * 1024
+    LOOP_LAG_THRESHOLD = int(os.getenv('LOOP_LAG_THRESHOLD_MS', '200')) / 1000
+    ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
     
     @classmethod
     def validate(cls):
+        print(f"🔍 .env: {env_path} ({'найден' if env_path.exists() else 'не найден'})")
         print(f"🔑 Получен токен: {'ДА' if cls.BOT_TOKEN else 'НЕТ'}")
         print(f"📏 Длина токена: {len(cls.BOT_TOKEN) if cls.BOT_TOKEN else 0}")
         
@@ -33,5 +51,3 @@ class Config:
         cls.TEMP_DIR.mkdir(exist_ok=True)
         print(f"✅ Temp папка: {cls.TEMP_DIR}")
         print("✅ Конфигурация загружена успешно!")
-
-Config.validate()
\ No newline at end of file
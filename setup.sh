@@ -48,7 +48,7 @@ Type=simple
 User=$USER
 WorkingDirectory=$WORK_DIR
 Environment="PATH=$WORK_DIR/venv/bin"
-ExecStart=$WORK_DIR/venv/bin/python $WORK_DIR/main.py
+ExecStart=$WORK_DIR/venv/bin/python -m src.main
 Restart=always
 RestartSec=10
 StandardOutput=journal
@@ -67,7 +67,7 @@ echo "=== УСТАНОВКА ЗАВЕРШЕНА ==="
 echo ""
 echo "Структура проекта:"
 echo "  .env              - файл с токеном бота (уже создан)"
-echo "  main.py           - точка входа"
+echo "  src/main.py       - точка входа (python -m src.main)"
 echo "  config/config.py  - конфигурация"
 echo "  src/              - исходный код"
 echo ""
@@ -82,5 +82,5 @@ echo "  Логи:        sudo journalctl -u bookmergerbot -f"
 echo ""
 echo "Для запуска вручную:"
 echo "  source venv/bin/activate"
-echo "  python main.py"
+echo "  python -m src.main"
 echo ""
\ No newline at end of file
@@ -1,26 +1,54 @@
-import zipfile
-import rarfile
-import tempfile
+import io
 import os
-import subprocess
+import queue
+import shutil
 import base64
-import uuid
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, BinaryIO, Callable, Optional, Union
 from src.models import BookContent, FB2Image
-import xml.etree.ElementTree as ET
+from src.mapped_io import MappedFile, feed_parser
+from src.spool import Spool, SpoolClosedError
+from src.fingerprint import UploadFingerprints, fingerprint_book
+from src.book_metadata import extract_metadata
+from src.series import book_sort_key
+from src.segments import build_book_section, dress_book_section, new_segment_token, render_segment
+from src.archive_walker import TAR_SUFFIXES, ArchiveLimits, ArchiveWalker, ChunkQueueReader, archive_kind
+from src.archive_tools import find_7z
+from src.workers import map_in_parse_pool
+from src.encoding import SAMPLE_SIZE, decode_text, parser_encoding
+from src.xml_parsers import discard_parser, get_parser
 from lxml import etree
-import imghdr
+
+STREAM_BUFFER_SIZE = 256 * 1024
+FB2_NAMESPACE = 'http://www.gribuser.ru/xml/fictionbook/2.0'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+XLINK_HREF = f'{{{XLINK_NS}}}href'
+FB2_SECTION = f'{{{FB2_NAMESPACE}}}section'
+FB2_TITLE = f'{{{FB2_NAMESPACE}}}title'
+FB2_P = f'{{{FB2_NAMESPACE}}}p'
 
 class ArchiveHandler:
-    def __init__(self, use_file_storage: bool = True):
-        self.supported_formats = ['.zip', '.rar', '.fb2']
+    def __init__(self, use_file_storage: bool = True, limits: Optional[ArchiveLimits] = None,
+                 scratch_dir: Optional[str] = None):
         self.use_file_storage = use_file_storage
-        self._setup_rarfile()
+        self.limits = limits or ArchiveLimits()
+        self.scratch_dir = scratch_dir
+        self._supported_formats: Optional[List[str]] = None
+    
+    @property
+    def supported_formats(self) -> List[str]:
+        # Поиск unrar и 7z откладывается до первого файла, чтобы не тормозить старт
+        if self._supported_formats is None:
+            self._supported_formats = ['.zip', '.fb2.zip', '.rar', '.fb2', *TAR_SUFFIXES]
+            self._setup_rarfile()
+            if find_7z():
+                self._supported_formats.append('.7z')
+        return self._supported_formats
     
     def _setup_rarfile(self):
         try:
             import platform
+            import rarfile
             is_windows = platform.system() == 'Windows'
             
             if is_windows:
@@ -34,109 +62,244 @@ class ArchiveHandler:
                     if os.path.exists(path):
                         rarfile.UNRAR_TOOL = path
                         return
-                
-                result = subprocess.run(['where', 'unrar'], capture_output=True, text=True)
-                if result.returncode == 0:
-                    rarfile.UNRAR_TOOL = result.stdout.strip()
-                    return
-            else:
-                # Linux/Unix: используем which для поиска unrar
-                result = subprocess.run(['which', 'unrar'], capture_output=True, text=True)
-                if result.returncode == 0:
-                    rarfile.UNRAR_TOOL = result.stdout.strip()
-                    return
+            
+            unrar_path = shutil.which('unrar')
+            if unrar_path:
+                rarfile.UNRAR_TOOL = unrar_path
+                return
             
             # Если unrar не найден, отключаем поддержку RAR
-            self.supported_formats = [ext for ext in self.supported_formats if ext != '.rar']
+            self._supported_formats = [ext for ext in self._supported_formats if ext != '.rar']
                 
         except Exception:
-            self.supported_formats = [ext for ext in self.supported_formats if ext != '.rar']
+            self._supported_formats = [ext for ext in self._supported_formats if ext != '.rar']
     
-    def extract_and_parse_file(self, file_path: str, user_id: int) -> Tuple[List[BookContent], str]:
-        temp_dir = tempfile.mkdtemp()
-        book_contents = []
-        
+    def extract_and_parse_file(self, file_path: str, user_id: int, spool: Optional[Spool] = None,
+                               fingerprints: Optional[UploadFingerprints] = None) -> Tuple[List[BookContent], str]:
         try:
             file_ext = Path(file_path).suffix.lower()
+            kind = archive_kind(file_path)
             
-            if file_ext == '.zip':
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-                book_contents = self._find_and_parse_fb2_files(temp_dir)
+            if kind == 'zip':
+                with MappedFile(file_path) as mapped:
+                    return self._parse_archive(mapped.fileobj(), file_path, spool, fingerprints), ""
             
-            elif file_ext == '.rar':
-                if not rarfile.tool_setup():
+            elif kind == 'rar':
+                import rarfile
+                if '.rar' not in self.supported_formats or not rarfile.tool_setup():
                     raise Exception("Инструмент unrar неправильно настроен")
                 
-                with rarfile.RarFile(file_path, 'r') as rar_ref:
-                    rar_ref.extractall(temp_dir)
-                book_contents = self._find_and_parse_fb2_files(temp_dir)
+                return self._parse_archive(file_path, file_path, spool, fingerprints), ""
+            
+            elif kind == '7z':
+                if '.7z' not in self.supported_formats:
+                    raise Exception("Архиватор 7z не установлен")
+                
+                return self._parse_archive(file_path, file_path, spool, fingerprints), ""
+            
+            elif kind == 'tar':
+                return self._parse_archive(file_path, file_path, spool, fingerprints), ""
             
             elif file_ext == '.fb2':
-                book_content = self._parse_fb2_with_images(file_path)
-                if book_content:
-                    book_contents.append(book_content)
-                os.rmdir(temp_dir)
-                temp_dir = ""
+                book_content = self._parse_fb2_with_images(file_path, spool, fingerprints)
+                return [book_content] if book_content else [], ""
             
             else:
                 raise Exception(f"Неподдерживаемый формат файла: {file_ext}")
             
-            return book_contents, temp_dir
+        except Exception as e:
+            raise Exception(f"Ошибка обработки файла: {str(e)}")
+    
+    def extract_and_parse_stream(self, fileobj: BinaryIO, filename: str, spool: Optional[Spool] = None,
+                                 fingerprints: Optional[UploadFingerprints] = None,
+                                 on_disk: bool = False) -> List[BookContent]:
+        try:
+            file_ext = Path(filename).suffix.lower()
+            
+            if on_disk and archive_kind(filename) == 'zip':
+                # Буфер уже перешёл во временный файл: центральный каталог и члены ZIP
+                # читаются из отображения в память, а не отдельными read() по файлу
+                with MappedFile(fileobj) as mapped:
+                    return self._parse_archive(mapped.fileobj(), filename, spool, fingerprints)
+            
+            elif archive_kind(filename) in ('zip', 'tar'):
+                return self._parse_archive(fileobj, filename, spool, fingerprints)
+            
+            elif file_ext == '.fb2':
+                book_content = self.parse_fb2_bytes(fileobj.read(), filename, spool, fingerprints)
+                return [book_content] if book_content else []
+            
+            else:
+                raise Exception(f"Неподдерживаемый формат файла: {file_ext}")
             
         except Exception as e:
-            if os.path.exists(temp_dir):
-                import shutil
-                shutil.rmtree(temp_dir)
             raise Exception(f"Ошибка обработки файла: {str(e)}")
     
-    def _find_and_parse_fb2_files(self, directory: str) -> List[BookContent]:
-        book_contents = []
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.lower().endswith('.fb2'):
-                    fb2_path = os.path.join(root, file)
-                    book_content = self._parse_fb2_with_images(fb2_path)
-                    if book_content:
-                        book_contents.append(book_content)
-        return book_contents
+    def parse_archive_chunks(self, chunks: queue.Queue, filename: str, spool: Optional[Spool] = None,
+                             fingerprints: Optional[UploadFingerprints] = None) -> List[BookContent]:
+        # Последовательные форматы (tar) разбираются прямо из потока загрузки
+        try:
+            reader = io.BufferedReader(ChunkQueueReader(chunks), STREAM_BUFFER_SIZE)
+            return self._parse_archive(reader, filename, spool, fingerprints)
+        except Exception as e:
+            raise Exception(f"Ошибка обработки файла: {str(e)}")
     
-    def _parse_fb2_with_images(self, fb2_path: str) -> BookContent:
+    def _parse_archive(self, source: Union[str, BinaryIO], filename: str, spool: Optional[Spool],
+                       fingerprints: Optional[UploadFingerprints] = None) -> List[BookContent]:
+        # Обход архива идёт в текущем потоке, найденные книги разбираются параллельно в пуле
+        walker = ArchiveWalker(self.limits, self.scratch_dir)
+        jobs = ((data, name, spool, fingerprints) for name, data in walker.walk(source, filename))
+        return [book_content for book_content in map_in_parse_pool(self.parse_fb2_bytes, jobs) if book_content]
+    
+    def _parse_fb2_with_images(self, fb2_path: str, spool: Optional[Spool] = None,
+                               fingerprints: Optional[UploadFingerprints] = None) -> Optional[BookContent]:
         try:
-            parser = etree.XMLParser(recover=True)
-            tree = etree.parse(fb2_path, parser)
-            root = tree.getroot()
+            with MappedFile(fb2_path) as mapped:
+                encoding = parser_encoding(mapped.prefix())
+                try:
+                    root = feed_parser(get_parser(encoding), mapped.buffer)
+                except Exception:
+                    discard_parser(encoding)
+                    root = None
+                
+                return self._build_book_content(
+                    root, Path(fb2_path).name, fb2_path, lambda: decode_text(mapped.buffer), spool, fingerprints
+                )
+        except OSError:
+            return self._build_book_content(None, Path(fb2_path).name, fb2_path, lambda: "", spool)
+    
+    def parse_fb2_bytes(self, data: bytes, filename: str, spool: Optional[Spool] = None,
+                        fingerprints: Optional[UploadFingerprints] = None) -> Optional[BookContent]:
+        encoding = parser_encoding(data[:SAMPLE_SIZE])
+        try:
+            root = etree.fromstring(data, get_parser(encoding))
+        except Exception:
+            discard_parser(encoding)
+            root = None
+        
+        return self._build_book_content(
+            root, filename, "", lambda: decode_text(data), spool, fingerprints
+        )
+    
+    def parse_fb2_chunks(self, chunks: queue.Queue, filename: str, spool: Optional[Spool] = None,
+                         fingerprints: Optional[UploadFingerprints] = None) -> Optional[BookContent]:
+        # Разбор идёт по мере поступления данных: очередь заполняется загрузчиком, None - конец файла
+        parser = None
+        encoding = None
+        raw_chunks = [] if not self.use_file_storage else None
+        feed_error = None
+        # Кодировка угадывается по SAMPLE_SIZE байт, а не по первому куску из сети: в коротком
+        # ASCII-начале файла без объявления кириллицы ещё нет
+        head: Optional[List[bytes]] = []
+        head_size = 0
+        
+        for chunk in iter(chunks.get, None):
+            if raw_chunks is not None:
+                raw_chunks.append(chunk)
+            if head is not None:
+                head.append(chunk)
+                head_size += len(chunk)
+                if head_size < SAMPLE_SIZE:
+                    continue
+                chunk, head = b"".join(head), None
+            if feed_error is None:
+                try:
+                    if parser is None:
+                        encoding = parser_encoding(chunk[:SAMPLE_SIZE])
+                        parser = get_parser(encoding)
+                    parser.feed(chunk)
+                except Exception as e:
+                    feed_error = e
+        
+        if head:
+            # Файл короче образца
+            try:
+                data = b"".join(head)
+                encoding = parser_encoding(data[:SAMPLE_SIZE])
+                parser = get_parser(encoding)
+                parser.feed(data)
+            except Exception as e:
+                feed_error = e
+        
+        root = None
+        if feed_error is None and parser is not None:
+            try:
+                root = parser.close()
+            except Exception:
+                root = None
+        if parser is not None and root is None:
+            discard_parser(encoding)
+        
+        data = b"".join(raw_chunks) if raw_chunks is not None else b""
+        return self._build_book_content(
+            root, filename, "", lambda: decode_text(data), spool, fingerprints
+        )
+    
+    def _build_book_content(self, root, filename: str, file_path: str, read_content: Callable[[], str],
+                            spool: Optional[Spool] = None,
+                            fingerprints: Optional[UploadFingerprints] = None) -> Optional[BookContent]:
+        try:
+            if root is None:
+                raise ValueError("Пустой документ")
             
             ns = {'fb': 'http://www.gribuser.ru/xml/fictionbook/2.0'}
             
-            title = self._extract_book_title(fb2_path)
-            images = self._extract_images(root, ns, fb2_path)
-            processed_content = self._process_content_with_images(root, images, ns)
+            title = self._extract_book_title(root, filename)
+            
+            # Точный дубликат отбрасывается до декодирования картинок и записи в спул
+            similar_to = ""
+            if fingerprints is not None:
+                check = fingerprints.check(fingerprint_book(root), title)
+                if check.duplicate:
+                    return None
+                similar_to = check.similar_to
+            
+            # Метаданные снимаются до правки ссылок на картинки: обложка ссылается на исходный id
+            metadata = extract_metadata(root)
+            images, image_data = self._extract_images(root, ns, filename)
+            
+            # Итоговая секция книги готовится здесь, в потоке разбора, пока дерево ещё в памяти:
+            # при слиянии остаётся только склеить готовые байты
+            token = new_segment_token()
+            book_section = self._build_book_section(root, title, metadata, images, ns, token)
+            segment = render_segment(book_section, images, image_data, token, spool)
             
             if self.use_file_storage:
                 original_content = ""
             else:
-                original_content = self._read_full_fb2(fb2_path)
+                original_content = read_content()
             
             book_content = BookContent(
                 content=original_content,
-                filename=Path(fb2_path).name,
+                filename=filename,
                 title=title,
                 images=images,
-                processed_content=processed_content,
-                file_path=fb2_path
+                file_path=file_path,
+                segment=segment,
+                similar_to=similar_to,
+                metadata=metadata,
+                sort_key=book_sort_key(
+                    title,
+                    metadata.sequence_name if metadata else "",
+                    metadata.sequence_number if metadata else ""
+                )
             )
             
             return book_content
             
+        except SpoolClosedError:
+            # Сессию очистили во время разбора: загрузка отбрасывается целиком, а не книгой-заглушкой
+            raise
+            
         except Exception:
-            content = self._read_full_fb2(fb2_path) if not self.use_file_storage else ""
-            title = self._extract_book_title(fb2_path)
+            content = read_content() if not self.use_file_storage else ""
+            title = self._extract_book_title(root, filename)
             return BookContent(
                 content=content,
-                filename=Path(fb2_path).name,
+                filename=filename,
                 title=title,
-                file_path=fb2_path
+                file_path=file_path,
+                sort_key=book_sort_key(title)
             )
     
     def _detect_image_extension(self, image_data: bytes) -> str:
@@ -159,6 +322,7 @@ class ArchiveHandler:
             return ".ico"
         
         try:
+            import imghdr
             detected = imghdr.what(None, image_data)
             if detected:
                 return f".{detected}"
@@ -185,8 +349,9 @@ class ArchiveHandler:
         else:
             return original_content_type
     
-    def _extract_images(self, root, ns, fb2_path: str) -> Dict[str, FB2Image]:
+    def _extract_images(self, root, ns, fb2_path: str) -> Tuple[Dict[str, FB2Image], Dict[str, bytes]]:
         images = {}
+        image_data_by_id = {}
         
         try:
             binary_elems = root.xpath('//fb:binary', namespaces=ns)
@@ -214,10 +379,11 @@ class ArchiveHandler:
                     images[binary_id] = FB2Image(
                         id=binary_id,
                         content_type=correct_content_type,
-                        data=image_data,
                         original_ref=f"#{binary_id}",
-                        actual_extension=actual_extension
+                        actual_extension=actual_extension,
+                        size=len(image_data)
                     )
+                    image_data_by_id[binary_id] = image_data
                             
                 except Exception:
                     continue
@@ -234,7 +400,7 @@ class ArchiveHandler:
         except Exception:
             pass
             
-        return images
+        return images, image_data_by_id
     
     def _validate_image_data(self, image_data: bytes, content_type: str) -> bool:
         if not image_data:
@@ -261,49 +427,54 @@ class ArchiveHandler:
         except Exception:
             return False
     
-    def _process_content_with_images(self, root, images: Dict[str, FB2Image], ns) -> str:
-        try:
-            processed_root = etree.fromstring(etree.tostring(root))
-            image_elems = processed_root.xpath('//fb:image', namespaces=ns)
-            
-            for image_elem in image_elems:
-                href = image_elem.get('{{{}}}href'.format('http://www.w3.org/1999/xlink'))
-                if href and href.startswith('#'):
-                    image_id = href[1:]
-                    if image_id in images:
-                        new_href = f"@@IMAGE_{image_id}@@"
-                        image_elem.set('{{{}}}href'.format('http://www.w3.org/1999/xlink'), new_href)
-            
-            return etree.tostring(processed_root, encoding='unicode', pretty_print=True)
-            
-        except Exception:
-            return etree.tostring(root, encoding='unicode')
-    
-    def _read_full_fb2(self, fb2_path: str) -> str:
-        try:
-            encodings = ['utf-8', 'windows-1251', 'cp1251', 'iso-8859-1']
-            
-            for encoding in encodings:
-                try:
-                    with open(fb2_path, 'r', encoding=encoding) as f:
-                        content = f.read()
-                    if '<?xml' in content or '<FictionBook' in content:
-                        return content
-                except UnicodeDecodeError:
-                    continue
-            
-            with open(fb2_path, 'rb') as f:
-                content_bytes = f.read()
-            return content_bytes.decode('utf-8', errors='ignore')
-            
-        except Exception:
-            return ""
+    def _build_book_section(self, root, title: str, metadata, images: Dict[str, FB2Image], ns, token: str):
+        # Дерево дальше не нужно, поэтому правится на месте. id сносок вида n_1 есть почти в каждой
+        # книге, поэтому id и ссылки на них и на картинки получают префикс книги
+        # Выборка атрибутов, а не элементов с предикатом, в разы быстрее на больших телах
+        ids = set()
+        for value in root.xpath('fb:body//@id', namespaces=ns):
+            ids.add(str(value))
+            value.getparent().set('id', f"{token}_{value}")
+        
+        for href in root.xpath('fb:body//@l:href', namespaces={**ns, 'l': XLINK_NS}):
+            if href.startswith('#') and (href[1:] in images or href[1:] in ids):
+                href.getparent().set(XLINK_HREF, f"#{token}_{href[1:]}")
+        
+        # Секцией книги становится сам <body>: перенос большого поддерева в новый документ
+        # обходится lxml дороже всего остального разбора. Собственный заголовок тела заменяется
+        # заголовком из метаданных, тела сносок (<body name="notes">) идут секциями в конце
+        bodies = root.findall('fb:body', namespaces=ns)
+        main_bodies = [body for body in bodies if not body.get('name')]
+        if not main_bodies:
+            return build_book_section(title, metadata, [])
+        
+        book_section = main_bodies[0]
+        book_section.tag = FB2_SECTION
+        book_section.attrib.clear()
+        own_title = book_section.find('fb:title', namespaces=ns)
+        if own_title is not None:
+            book_section.remove(own_title)
+        
+        for body in bodies:
+            if body is book_section:
+                continue
+            if body.get('name'):
+                body.tag = FB2_SECTION
+                body.attrib.clear()
+                if body.find('fb:title', namespaces=ns) is None:
+                    notes_title = etree.Element(FB2_TITLE)
+                    etree.SubElement(notes_title, FB2_P).text = "Примечания"
+                    body.insert(0, notes_title)
+                book_section.append(body)
+            else:
+                book_section.extend(child for child in list(body) if child.tag != FB2_TITLE)
+        
+        return dress_book_section(book_section, title, metadata)
     
-    def _extract_book_title(self, fb2_path: str) -> str:
+    def _extract_book_title(self, root, filename: str) -> str:
         try:
-            parser = etree.XMLParser(recover=True)
-            tree = etree.parse(fb2_path, parser)
-            root = tree.getroot()
+            if root is None:
+                raise ValueError("Пустой документ")
             
             ns = {'fb': 'http://www.gribuser.ru/xml/fictionbook/2.0'}
             
@@ -319,14 +490,9 @@ class ArchiveHandler:
                 if title:
                     return title
             
-            filename = Path(fb2_path).stem
+            filename = Path(filename).stem
             return filename if filename else "Без названия"
             
         except Exception:
-            filename = Path(fb2_path).stem
+            filename = Path(filename).stem
             return filename if filename else "Без названия"
-    
-    def is_supported_file(self, filename: str) -> bool:
-        if not filename:
-            return False
-        return any(filename.lower().endswith(ext) for ext in self.supported_formats)
\ No newline at end of file
@@ -0,0 +1,160 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+TOOL_ENV = dict(os.environ, LC_ALL='C.UTF-8', LANG='C.UTF-8')
+PIPE_BUFFER_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def find_7z() -> Optional[str]:
+    for name in ('7z', '7za', '7zz'):
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def find_unrar() -> Optional[str]:
+    # Путь к unrar уже подобран при настройке rarfile (на Windows это может быть WinRAR)
+    import rarfile
+    return shutil.which(rarfile.UNRAR_TOOL)
+
+
+def archive_tool_available(kind: str) -> bool:
+    # ZIP и tar читает стандартная библиотека, для 7z и RAR нужны внешние программы
+    if kind == '7z':
+        return find_7z() is not None
+    if kind == 'rar':
+        try:
+            return find_unrar() is not None
+        except ImportError:
+            return False
+    return True
+
+
+def rar_is_solid(archive) -> bool:
+    # В rarfile 4.0 нет is_solid(): флаг читается из главного заголовка, у RAR3 и RAR5 он разный.
+    # Если заголовок недоступен, архив считается solid - один проход корректен для любого архива
+    import rarfile
+    main = getattr(getattr(archive, '_file_parser', None), '_main', None)
+    if main is None:
+        return True
+    main_flags = getattr(main, 'main_flags', None)
+    if main_flags is not None:
+        return bool(main_flags & rarfile.RAR5_MAIN_FLAG_SOLID)
+    return bool(main.flags & rarfile.RAR_MAIN_SOLID)
+
+
+class ToolStream(io.RawIOBase):
+    # stdout архиватора как файловый объект: данные читаются по мере распаковки,
+    # а при закрытии процесс завершается и проверяется код возврата
+    def __init__(self, args: List[str]):
+        self._process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                         stdin=subprocess.DEVNULL, env=TOOL_ENV, bufsize=PIPE_BUFFER_SIZE)
+        self._finished = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = self._process.stdout.readinto(buffer)
+        if not count:
+            self._finished = True
+        return count
+
+    def close(self):
+        if self.closed:
+            return
+        process = self._process
+        if not self._finished:
+            process.kill()
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode = process.wait()
+        super().close()
+        if self._finished and returncode != 0:
+            raise OSError(f"{os.path.basename(process.args[0])}: {stderr.decode('utf-8', 'replace').strip()}")
+
+
+def list_7z(archive_path: str) -> Iterator[Tuple[str, int, int]]:
+    # Технический листинг (-slt): блоки "Ключ = значение", первый блок описывает сам архив
+    result = subprocess.run([find_7z(), 'l', '-slt', '--', archive_path],
+                            capture_output=True, env=TOOL_ENV, check=True)
+    listing = result.stdout.decode('utf-8', 'replace')
+    _, _, entries = listing.partition('\n----------\n')
+
+    for block in entries.split('\n\n'):
+        fields = dict(line.split(' = ', 1) for line in block.splitlines() if ' = ' in line)
+        if 'Path' not in fields or fields.get('Folder') == '+' or fields.get('Attributes', '').startswith('D'):
+            continue
+        yield fields['Path'], int(fields.get('Size') or 0), int(fields.get('Packed Size') or 0)
+
+
+def open_7z_stream(archive_path: str) -> ToolStream:
+    # Все члены архива подряд в порядке листинга: один проход даже для solid-архивов
+    return ToolStream([find_7z(), 'e', '-so', '--', archive_path])
+
+
+class BoundedReader(io.RawIOBase):
+    # Окно из size байт в общем потоке; при закрытии непрочитанный остаток пропускается
+    def __init__(self, stream: io.RawIOBase, size: int):
+        self._stream = stream
+        self._left = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._left <= 0:
+            return 0
+        view = memoryview(buffer)[:self._left]
+        count = self._stream.readinto(view)
+        if not count:
+            raise EOFError("Архив оборвался раньше ожидаемого")
+        self._left -= count
+        return count
+
+    def close(self):
+        if not self.closed:
+            while self._left > 0:
+                if not self.read(min(self._left, PIPE_BUFFER_SIZE)):
+                    break
+        super().close()
+
+
+def open_rar_stream(archive_path: str, member: Optional[str] = None) -> ToolStream:
+    # Без имени члена unrar p выводит все файлы архива подряд в порядке листинга
+    args = [find_unrar(), 'p', '-inul', '-c-', '-p-', '--', archive_path]
+    if member is not None:
+        args.append(member)
+    return ToolStream(args)
+
+
+def read_rar_member(archive_path: str, member: str, size: int, max_memory: int,
+                    scratch_dir: Optional[str] = None) -> BinaryIO:
+    # Член копируется кусками в буфер, который после max_memory уходит на диск: параллельные
+    # задания держат в памяти не больше max_memory каждое. Читается не больше заявленного размера,
+    # заголовок архива мог соврать
+    buffer = tempfile.SpooledTemporaryFile(max_size=max_memory, dir=scratch_dir)
+    try:
+        with open_rar_stream(archive_path, member) as stream:
+            left = size
+            while left > 0:
+                chunk = stream.read(min(left, PIPE_BUFFER_SIZE))
+                if not chunk:
+                    raise EOFError(f"Архив оборвался на {member}")
+                buffer.write(chunk)
+                left -= len(chunk)
+            if stream.read(1):
+                raise OSError(f"Размер {member} в архиве не совпадает с заявленным")
+        buffer.seek(0)
+        return buffer
+    except BaseException:
+        buffer.close()
+        raise
@@ -0,0 +1,235 @@
+import io
+import queue
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple, Union
+
+from src.archive_tools import (
+    BoundedReader, ToolStream, archive_tool_available, list_7z, open_7z_stream, open_rar_stream,
+    rar_is_solid, read_rar_member
+)
+from src.workers import map_in_extract_pool
+
+READ_CHUNK_SIZE = 1024 * 1024
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+# Маленькие файлы сжимаются как угодно сильно и опасности не представляют
+RATIO_CHECK_MIN_SIZE = 1024 * 1024
+
+
+class ArchiveLimitError(Exception):
+    pass
+
+
+@dataclass(slots=True, frozen=True)
+class ArchiveLimits:
+    max_depth: int = 3
+    max_ratio: float = 100
+    max_unpacked: int = 1024 * 1024 * 1024
+    spool_max_memory: int = 16 * 1024 * 1024
+
+
+def archive_kind(filename: str) -> Optional[str]:
+    name = filename.lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith('.rar'):
+        return 'rar'
+    if name.endswith('.7z'):
+        return '7z'
+    if name.endswith(TAR_SUFFIXES):
+        return 'tar'
+    return None
+
+
+def is_fb2_name(filename: str) -> bool:
+    return filename.lower().endswith('.fb2')
+
+
+class ArchiveWalker:
+    # Рекурсивно обходит вложенные архивы (.fb2.zip внутри ZIP, ZIP внутри RAR и т.д.)
+    # и отдаёт найденные FB2 как (имя, байты) без распаковки на диск
+    def __init__(self, limits: ArchiveLimits, scratch_dir: Optional[str] = None):
+        self.limits = limits
+        self.scratch_dir = scratch_dir
+        self.unpacked = 0
+
+    def walk(self, source: Union[str, BinaryIO], filename: str, depth: int = 0) -> Iterator[Tuple[str, bytes]]:
+        kind = archive_kind(filename)
+        if kind == 'zip':
+            yield from self._walk_zip(source, depth)
+        elif kind == 'rar':
+            yield from self._walk_rar(source, depth)
+        elif kind == '7z':
+            yield from self._walk_7z(source, depth)
+        elif kind == 'tar':
+            yield from self._walk_tar(source, depth)
+
+    def _walk_zip(self, source: Union[str, BinaryIO], depth: int) -> Iterator[Tuple[str, bytes]]:
+        with zipfile.ZipFile(source, 'r') as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                yield from self._visit(info.filename, info.file_size, info.compress_size,
+                                       lambda info=info: archive.open(info), depth)
+
+    def _walk_rar(self, source: Union[str, BinaryIO], depth: int) -> Iterator[Tuple[str, bytes]]:
+        # Заголовки читает rarfile один раз, сами данные отдаёт unrar p через stdout
+        import rarfile
+        with self._as_path(source, '.rar') as archive_path:
+            with rarfile.RarFile(archive_path, 'r') as archive:
+                entries = [(info.filename, info.file_size, info.compress_size)
+                           for info in archive.infolist() if not info.is_dir()]
+                solid = rar_is_solid(archive)
+
+            if solid:
+                # В solid-архиве каждый член распаковывается с начала блока, поэтому один проход
+                yield from self._walk_stream(entries, open_rar_stream(archive_path), depth)
+                return
+
+            selected = [entry for entry in entries if self._wanted(entry[0], depth)]
+            # Задания распаковки идут параллельно и опережают _visit, поэтому лимит на объём
+            # проверяется по заявленным размерам до запуска, а не по уже прочитанному
+            planned = self.unpacked
+            for name, size, packed in selected:
+                self._check_ratio(name, size, packed)
+                planned += size
+                if planned > self.limits.max_unpacked:
+                    raise ArchiveLimitError("Архив слишком большой после распаковки")
+
+            jobs = ((archive_path, name, size, self.limits.spool_max_memory, self.scratch_dir)
+                    for name, size, _ in selected)
+            for (name, size, packed), member in zip(selected, map_in_extract_pool(read_rar_member, jobs)):
+                yield from self._visit(name, size, packed, lambda member=member: member, depth)
+
+    def _walk_7z(self, source: Union[str, BinaryIO], depth: int) -> Iterator[Tuple[str, bytes]]:
+        # 7z читает только с диска; члены архива идут подряд из stdout одного процесса,
+        # границы между ними известны по размерам из листинга
+        with self._as_path(source, '.7z') as archive_path:
+            yield from self._walk_stream(list(list_7z(archive_path)), open_7z_stream(archive_path), depth)
+
+    def _walk_stream(self, entries: List[Tuple[str, int, int]], stream: ToolStream,
+                     depth: int) -> Iterator[Tuple[str, bytes]]:
+        with stream:
+            for name, size, packed in entries:
+                member = BoundedReader(stream, size)
+                yield from self._visit(name, size, packed, lambda member=member: member, depth)
+                member.close()
+
+    def _walk_tar(self, source: Union[str, BinaryIO], depth: int) -> Iterator[Tuple[str, bytes]]:
+        # Режим 'r|*' читает tar строго последовательно, поэтому подходит и для потока загрузки
+        with self._as_stream(source) as stream, tarfile.open(fileobj=stream, mode='r|*') as archive:
+            unpacked_before = self.unpacked
+            for member in archive:
+                if not member.isfile():
+                    continue
+                # Размер сжатой части у членов tar неизвестен, степень сжатия считается по всему потоку
+                yield from self._visit(member.name, member.size, 0,
+                                       lambda member=member: archive.extractfile(member), depth)
+                self._check_ratio(member.name, self.unpacked - unpacked_before, stream.consumed)
+
+    @contextmanager
+    def _as_path(self, source: Union[str, BinaryIO], suffix: str) -> Iterator[str]:
+        if isinstance(source, str):
+            yield source
+            return
+
+        with tempfile.NamedTemporaryFile(suffix=suffix, dir=self.scratch_dir) as copy:
+            shutil.copyfileobj(source, copy, READ_CHUNK_SIZE)
+            copy.flush()
+            yield copy.name
+
+    @contextmanager
+    def _as_stream(self, source: Union[str, BinaryIO]) -> Iterator['_CountingReader']:
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                yield _CountingReader(f)
+        else:
+            yield _CountingReader(source)
+
+    def _wanted(self, name: str, depth: int) -> bool:
+        if is_fb2_name(name):
+            return True
+        kind = archive_kind(name)
+        if kind is None or depth + 1 > self.limits.max_depth:
+            return False
+        # Вложенный 7z или RAR без программы для него пропускается, остальные книги загрузки остаются
+        return archive_tool_available(kind)
+
+    def _visit(self, name: str, size: int, packed: int, open_member: Callable[[], BinaryIO],
+               depth: int) -> Iterator[Tuple[str, bytes]]:
+        if not self._wanted(name, depth):
+            return
+
+        self._check_ratio(name, size, packed)
+
+        if is_fb2_name(name):
+            with open_member() as member:
+                yield Path(name).name, self._read(member, name, packed)
+            return
+
+        # Вложенному архиву нужен произвольный доступ: небольшие остаются в памяти
+        with open_member() as member, \
+                tempfile.SpooledTemporaryFile(max_size=self.limits.spool_max_memory,
+                                               dir=self.scratch_dir) as buffer:
+            for chunk in self._iter_chunks(member, name, packed):
+                buffer.write(chunk)
+            buffer.seek(0)
+            yield from self.walk(buffer, name, depth + 1)
+
+    def _check_ratio(self, name: str, size: int, packed: int):
+        if packed and size > RATIO_CHECK_MIN_SIZE and size / packed > self.limits.max_ratio:
+            raise ArchiveLimitError(f"Подозрительно сильное сжатие: {Path(name).name}")
+
+    def _iter_chunks(self, member: BinaryIO, name: str, packed: int) -> Iterator[bytes]:
+        # Заголовкам архива нельзя верить, поэтому лимиты проверяются и по фактически прочитанному
+        read = 0
+        while chunk := member.read(READ_CHUNK_SIZE):
+            read += len(chunk)
+            self.unpacked += len(chunk)
+            if self.unpacked > self.limits.max_unpacked:
+                raise ArchiveLimitError("Архив слишком большой после распаковки")
+            self._check_ratio(name, read, packed)
+            yield chunk
+
+    def _read(self, member: BinaryIO, name: str, packed: int) -> bytes:
+        return b"".join(self._iter_chunks(member, name, packed))
+
+
+class _CountingReader:
+    def __init__(self, fileobj: BinaryIO):
+        self._fileobj = fileobj
+        self.consumed = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._fileobj.read(size)
+        self.consumed += len(data)
+        return data
+
+
+class ChunkQueueReader(io.RawIOBase):
+    # Поток загрузки как файловый объект для последовательных форматов: None в очереди - конец
+    def __init__(self, chunks: queue.Queue):
+        self._chunks = chunks
+        self._pending = b""
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending and not self._eof:
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._pending = chunk
+
+        count = min(len(buffer), len(self._pending))
+        buffer[:count] = self._pending[:count]
+        self._pending = self._pending[count:]
+        return count
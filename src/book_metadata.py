@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+FB2_NS = {'fb': 'http://www.gribuser.ru/xml/fictionbook/2.0'}
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+
+@dataclass(slots=True, frozen=True)
+class Author:
+    first_name: str = ""
+    middle_name: str = ""
+    last_name: str = ""
+    nickname: str = ""
+
+    @property
+    def display_name(self) -> str:
+        name = ' '.join(part for part in (self.first_name, self.middle_name, self.last_name) if part)
+        return name or self.nickname
+
+    @property
+    def key(self) -> str:
+        return ' '.join(self.display_name.lower().split())
+
+
+@dataclass(slots=True, frozen=True)
+class BookMetadata:
+    authors: Tuple[Author, ...] = ()
+    genres: Tuple[str, ...] = ()
+    lang: str = ""
+    sequence_name: str = ""
+    sequence_number: str = ""
+    # Содержимое <annotation> как XML-фрагмент, без самого элемента
+    annotation: str = ""
+    cover_image_id: str = ""
+
+
+def _flatten(elem) -> str:
+    return ' '.join(''.join(elem.itertext()).split())
+
+
+def _text(elem, path: str) -> str:
+    child = elem.find(path, namespaces=FB2_NS)
+    return _flatten(child) if child is not None else ""
+
+
+def _authors(title_info) -> Tuple[Author, ...]:
+    authors: List[Author] = []
+    for elem in title_info.findall('fb:author', namespaces=FB2_NS):
+        author = Author(
+            first_name=_text(elem, 'fb:first-name'),
+            middle_name=_text(elem, 'fb:middle-name'),
+            last_name=_text(elem, 'fb:last-name'),
+            nickname=_text(elem, 'fb:nickname'),
+        )
+        if author.display_name:
+            authors.append(author)
+    return tuple(authors)
+
+
+def _annotation(title_info) -> str:
+    from lxml import etree
+    annotation = title_info.find('fb:annotation', namespaces=FB2_NS)
+    if annotation is None:
+        return ""
+    return ''.join(etree.tostring(child, encoding='unicode', with_tail=False) for child in annotation
+                   if isinstance(child.tag, str))
+
+
+def _cover_image_id(title_info) -> str:
+    image = title_info.find('fb:coverpage/fb:image', namespaces=FB2_NS)
+    href = image.get(XLINK_HREF, "") if image is not None else ""
+    return href[1:] if href.startswith('#') else ""
+
+
+def extract_metadata(root) -> Optional[BookMetadata]:
+    # Снимается один раз при разборе: при склейке исходные файлы уже не перечитываются
+    try:
+        title_info = root.find('fb:description/fb:title-info', namespaces=FB2_NS)
+        if title_info is None:
+            return None
+
+        genres = tuple(dict.fromkeys(
+            text for text in map(_flatten, title_info.findall('fb:genre', namespaces=FB2_NS)) if text
+        ))
+        sequence = title_info.find('fb:sequence', namespaces=FB2_NS)
+        return BookMetadata(
+            authors=_authors(title_info),
+            genres=genres,
+            lang=_text(title_info, 'fb:lang'),
+            sequence_name=(sequence.get('name') or "").strip() if sequence is not None else "",
+            sequence_number=(sequence.get('number') or "").strip() if sequence is not None else "",
+            annotation=_annotation(title_info),
+            cover_image_id=_cover_image_id(title_info),
+        )
+    except Exception:
+        return None
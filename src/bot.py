@@ -1,12 +1,9 @@
 import logging
-import os
-import shutil
-import asyncio
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from dataclasses import dataclass, field
-from asyncio import Lock
-from datetime import datetime, timedelta
+from functools import partial
 
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.types import (
@@ -19,6 +16,13 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 
+from src.ingest import UserIngestQueue, ingest_document, is_supported_upload
+from src.metrics import Metrics, format_stats
+from src.session_lock import SessionLock
+from src.spool import Spool
+from src.workers import run_in_io_pool, run_in_merge_pool
+from src.workspace import WorkspaceManager, WorkspaceQuotaError
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -35,7 +39,13 @@ class BotData:
     merger: Optional['FB2Merger'] = None
     config: Optional['Config'] = None
     bot_instance: Optional[Bot] = None
-    user_locks: Dict[int, Lock] = field(default_factory=dict)
+    user_locks: Dict[int, SessionLock] = field(default_factory=dict)
+    ingest_queues: Dict[int, UserIngestQueue] = field(default_factory=dict)
+    status_updater: Optional['StatusUpdater'] = None
+    workspace: Optional[WorkspaceManager] = None
+    metrics: Metrics = field(default_factory=Metrics)
+    loop_monitor: Optional['LoopLagMonitor'] = None
+    send_queue: Optional['SendQueue'] = None
 
 bot_data = BotData()
 
@@ -68,6 +78,17 @@ def get_cancel_reply_keyboard() -> ReplyKeyboardMarkup:
         one_time_keyboard=True
     )
 
+def get_sort_reply_keyboard() -> ReplyKeyboardMarkup:
+    keyboard = [
+        [KeyboardButton(text="🔢 Авто-сортировка")],
+        [KeyboardButton(text="❌ Отмена")]
+    ]
+    return ReplyKeyboardMarkup(
+        keyboard=keyboard,
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+
 def get_main_inline_keyboard():
     keyboard = [
         [
@@ -79,6 +100,7 @@ def get_main_inline_keyboard():
             InlineKeyboardButton(text="ℹ️ Справка", callback_data="show_help")
         ],
         [
+            InlineKeyboardButton(text="🔢 Авто-сортировка", callback_data="auto_sort_books"),
             InlineKeyboardButton(text="🗑️ Очистить сессию", callback_data="clear_session")
         ]
     ]
@@ -88,16 +110,24 @@ def create_status_message(session: 'UserSession') -> str:
     books_count = len(session.book_contents)
     
     if books_count == 0:
+        if session.pending_uploads:
+            return f"⏳ Обрабатываю файлы: {session.pending_uploads}"
         return "📚 Нет загруженных книг\n\n📥 Отправьте архив (ZIP/RAR) с FB2 файлами или отдельные FB2 файлы."
     
     sorted_books = session.get_sorted_books()
-    books_list = "\n".join([f"{i+1}. {book.title}" for i, book in enumerate(sorted_books)])
+    books_list = "\n".join([
+        f"{i+1}. {book.title}" + (f" ⚠️ похожа на «{book.similar_to}»" if book.similar_to else "")
+        for i, book in enumerate(sorted_books)
+    ])
     
     series_title = session.get_series_title()
     memory_usage = session.get_memory_usage() // (1024*1024) if books_count > 0 else 0
+    pending_line = f"⏳ В обработке файлов: {session.pending_uploads}\n" if session.pending_uploads else ""
+    skipped = session.fingerprints.skipped_total
+    duplicates_line = f"🔁 Пропущено дубликатов: {skipped}\n" if skipped else ""
     
     return f"""📚 Загружено {books_count} книг
-💾 Память: ~{memory_usage} MB
+{pending_line}{duplicates_line}💾 Память: ~{memory_usage} MB
 📖 Название сборника: {series_title}
 
 📋 Книги в сборнике:
@@ -105,76 +135,6 @@ def create_status_message(session: 'UserSession') -> str:
 
 ⚙️ Используйте кнопки ниже для управления:"""
 
-async def create_status_message_at_bottom(chat_id: int, session: 'UserSession') -> bool:
-    try:
-        bot = bot_data.bot_instance
-        if not bot:
-            return False
-
-        if session.status_message_id:
-            try:
-                await bot.delete_message(
-                    chat_id=chat_id,
-                    message_id=session.status_message_id
-                )
-            except Exception:
-                pass
-            finally:
-                session.status_message_id = None
-
-        status_text = create_status_message(session)
-        
-        msg = await bot.send_message(
-            chat_id=chat_id,
-            text=status_text,
-            reply_markup=get_main_inline_keyboard()
-        )
-        session.status_message_id = msg.message_id
-        return True
-        
-    except Exception:
-        session.status_message_id = None
-        return False
-
-async def update_or_create_status(chat_id: int, session: 'UserSession', force_new: bool = False) -> bool:
-    try:
-        bot = bot_data.bot_instance
-        if not bot:
-            return False
-            
-        if len(session.book_contents) == 0:
-            if session.status_message_id:
-                try:
-                    await bot.delete_message(
-                        chat_id=chat_id,
-                        message_id=session.status_message_id
-                    )
-                except Exception:
-                    pass
-                finally:
-                    session.status_message_id = None
-            return True
-
-        if force_new or not session.status_message_id:
-            return await create_status_message_at_bottom(chat_id, session)
-
-        try:
-            status_text = create_status_message(session)
-            await bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=session.status_message_id,
-                text=status_text,
-                reply_markup=get_main_inline_keyboard()
-            )
-            return True
-            
-        except Exception:
-            return await create_status_message_at_bottom(chat_id, session)
-                
-    except Exception:
-        session.status_message_id = None
-        return False
-
 def get_or_create_session(user_id: int) -> 'UserSession':
     if user_id not in bot_data.sessions:
         from src.models import UserSession
@@ -182,37 +142,113 @@ def get_or_create_session(user_id: int) -> 'UserSession':
     
     return bot_data.sessions[user_id]
 
-def get_or_create_lock(user_id: int) -> Lock:
+def get_or_create_lock(user_id: int) -> SessionLock:
     if user_id not in bot_data.user_locks:
-        bot_data.user_locks[user_id] = Lock()
+        bot_data.user_locks[user_id] = SessionLock(bot_data.metrics.lock_wait)
     
     return bot_data.user_locks[user_id]
 
-def cleanup_user_session(user_id: int):
+def get_archive_handler() -> 'ArchiveHandler':
+    # lxml и rarfile подгружаются при первом файле, а не при старте бота
+    if bot_data.archive_handler is None:
+        from src.archive_handler import ArchiveHandler
+        from src.archive_walker import ArchiveLimits
+        config = bot_data.config
+        bot_data.archive_handler = ArchiveHandler(use_file_storage=True, limits=ArchiveLimits(
+            max_depth=config.ARCHIVE_MAX_DEPTH,
+            max_ratio=config.ARCHIVE_MAX_RATIO,
+            max_unpacked=config.ARCHIVE_MAX_UNPACKED,
+            spool_max_memory=config.SPOOL_MAX_MEMORY
+        ), scratch_dir=str(get_workspace().scratch))
+    
+    return bot_data.archive_handler
+
+def get_supported_formats() -> List[str]:
+    return get_archive_handler().supported_formats
+
+def get_workspace() -> WorkspaceManager:
+    if bot_data.workspace is None:
+        config = bot_data.config
+        bot_data.workspace = WorkspaceManager(
+            config.TEMP_DIR,
+            max_bytes=config.WORKSPACE_MAX_BYTES,
+            user_max_bytes=config.WORKSPACE_USER_MAX_BYTES
+        )
+    
+    return bot_data.workspace
+
+def get_merger() -> 'FB2Merger':
+    if bot_data.merger is None:
+        from src.fb2_merger import FB2Merger
+        bot_data.merger = FB2Merger(max_memory_mb=2048)
+    
+    return bot_data.merger
+
+def get_merge_output(user_id: int, series_title: str) -> Tuple[str, Path]:
+    # Файл пишется вне папки пользователя: /clear, пришедший во время отправки, его не удалит
+    safe_title = "".join(c for c in series_title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    return f"{safe_title}.fb2", get_workspace().merge_path(user_id)
+
+def merge_to_file(snapshot: 'SessionSnapshot', output_path: Path) -> bool:
+    # Выполняется целиком в пуле: импорт lxml при первом слиянии, создание папки и сборка файла
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    return get_merger().create_merged_fb2(
+        list(snapshot.books), str(output_path), snapshot.series_title, snapshot.spool
+    ) and output_path.exists()
+
+def get_or_create_ingest_queue(user_id: int) -> UserIngestQueue:
+    if user_id not in bot_data.ingest_queues:
+        bot_data.ingest_queues[user_id] = UserIngestQueue(bot_data.config.MAX_PARALLEL_UPLOADS)
+    
+    return bot_data.ingest_queues[user_id]
+
+@asynccontextmanager
+async def clearing_session(user_id: int) -> AsyncIterator[None]:
+    # Запись для очистки сессии. Идущее слияние читает спул по пути, поэтому очистка ждёт
+    # конца сборки до блокировки, а не под ней: список, меню и загрузки пока не стоят.
+    # Блокировка у пользователя одна на всё время работы бота: ждущие старой не разойдутся
+    # с теми, кто создал бы новую
+    user_lock = get_or_create_lock(user_id)
+    while True:
+        session = bot_data.sessions.get(user_id)
+        if session is not None:
+            await session.files_released.wait()
+        async with user_lock.write():
+            # Пока ждали блокировку, могло начаться новое слияние
+            session = bot_data.sessions.get(user_id)
+            if session is None or session.files_released.is_set():
+                yield
+                return
+
+async def cleanup_user_session(user_id: int):
+    # Вызывается внутри clearing_session
+    workspace = get_workspace()
+    
     if user_id in bot_data.sessions:
         session = bot_data.sessions[user_id]
 
         for temp_dir in session.temp_dirs:
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir, ignore_errors=True)
+            await workspace.remove(Path(temp_dir))
+
+        if session.spool:
+            await run_in_io_pool(session.spool.close)
 
         del bot_data.sessions[user_id]
 
-    user_dir = Path(bot_data.config.TEMP_DIR) / str(user_id)
-    if user_dir.exists():
-        shutil.rmtree(user_dir, ignore_errors=True)
+    if bot_data.status_updater:
+        bot_data.status_updater.forget(user_id)
+
+    # Папка переименовывается мгновенно, а удаляется в фоновом потоке
+    await workspace.remove_user(user_id)
 
-    if user_id in bot_data.user_locks:
-        del bot_data.user_locks[user_id]
+    bot_data.ingest_queues.pop(user_id, None)
 
 @router.message(CommandStart())
 async def cmd_start(message: Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    user_lock = get_or_create_lock(user_id)
-    
-    async with user_lock:
+    async with clearing_session(user_id):
         session = None
         if user_id in bot_data.sessions:
             session = bot_data.sessions[user_id]
@@ -226,7 +262,7 @@ async def cmd_start(message: Message):
             except Exception:
                 pass
 
-        cleanup_user_session(user_id)
+        await cleanup_user_session(user_id)
 
         session = get_or_create_session(user_id)
         
@@ -238,7 +274,9 @@ async def cmd_start(message: Message):
 Поддерживаемые форматы:
 - ZIP архивы с FB2
 - RAR архивы с FB2  
-- Отдельные FB2 файлы
+- Отдельные FB2 файлы и FB2.ZIP
+- 7Z и TAR (в том числе .tar.gz, .tar.bz2, .tar.xz)
+- Вложенные архивы (ZIP в ZIP, ZIP в RAR)
 
 Команды:
 /start - Начало работы (очистить всё)
@@ -261,6 +299,7 @@ async def cmd_help(message: Message):
 Доступные действия:
 📚 Слить книги - объединить все книги в один FB2
 📝 Сортировать книги - изменить порядок книг
+🔢 Авто-сортировка - по номерам книг в серии
 ✏️ Назвать сборник - задать название для сборника
 📋 Список книг - показать все загруженные книги
 🗑️ Очистить сессию - удалить все загруженные книги"""
@@ -275,9 +314,7 @@ async def cmd_clear(message: Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    user_lock = get_or_create_lock(user_id)
-    
-    async with user_lock:
+    async with clearing_session(user_id):
         session = None
         if user_id in bot_data.sessions:
             session = bot_data.sessions[user_id]
@@ -291,7 +328,7 @@ async def cmd_clear(message: Message):
             except Exception:
                 pass
 
-        cleanup_user_session(user_id)
+        await cleanup_user_session(user_id)
 
         session = get_or_create_session(user_id)
 
@@ -306,20 +343,38 @@ async def cmd_list(message: Message):
 
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
+    async with user_lock.read():
         session = get_or_create_session(user_id)
         
         if not session.book_contents:
-            await message.answer("📭 Нет загруженных книг.")
-            return
-        
-        books_list = "\n".join([f"{i+1}. {book.title}" for i, book in enumerate(session.book_contents)])
-        response = f"📚 Загружено книг: {len(session.book_contents)}\n\n{books_list}"
-        
-        await message.answer(
-            response,
-            reply_markup=get_main_reply_keyboard()
-        )
+            response = None
+        else:
+            books_list = "\n".join([f"{i+1}. {book.title}" for i, book in enumerate(session.book_contents)])
+            response = f"📚 Загружено книг: {len(session.book_contents)}\n\n{books_list}"
+    
+    # Ответ уходит уже без блокировки: изменения сессии не ждут сети
+    if response is None:
+        await message.answer("📭 Нет загруженных книг.")
+        return
+    
+    await message.answer(
+        response,
+        reply_markup=get_main_reply_keyboard()
+    )
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if message.from_user.id not in bot_data.config.ADMIN_IDS:
+        await message.answer("⛔ Команда доступна только администраторам.")
+        return
+    
+    loop_monitor = bot_data.loop_monitor
+    send_queue = bot_data.send_queue
+    await message.answer(format_stats(
+        bot_data.metrics,
+        stalls=loop_monitor.stalls if loop_monitor else 0,
+        send_stats=send_queue.stats if send_queue else None
+    ))
 
 @router.message(F.text == "📚 Слить книги")
 async def handle_merge_reply(message: Message):
@@ -328,60 +383,63 @@ async def handle_merge_reply(message: Message):
     
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
+    # Проверка, снимок и отметка о слиянии делаются одним шагом под записью: два нажатия подряд
+    # не запустят две сборки. Сама сборка идёт без блокировки, и список, сортировка
+    # и новые загрузки не ждут готового файла
+    async with user_lock.write():
         session = get_or_create_session(user_id)
         
+        refusal = None
         if len(session.book_contents) < 2:
-            await message.answer(
-                "❌ Нужно как минимум 2 книги для слияния.",
-                reply_markup=get_main_reply_keyboard()
-            )
-            return
-        
+            refusal = "❌ Нужно как минимум 2 книги для слияния."
+        elif session.merging:
+            refusal = "⏳ Сборник уже собирается, дождитесь файла."
+        else:
+            snapshot = session.snapshot()
+            session.merging = True
+    
+    if refusal:
+        await message.answer(refusal, reply_markup=get_main_reply_keyboard())
+        return
+    
+    try:
         try:
             processing_msg = await message.answer("🔄 Начинаю слияние книг...")
             
-            sorted_books = session.get_sorted_books()
-            series_title = session.get_series_title()
+            output_filename, output_path = get_merge_output(user_id, snapshot.series_title)
             
-            safe_title = "".join(c for c in series_title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            output_filename = f"{safe_title}.fb2"
-            output_path = Path(bot_data.config.TEMP_DIR) / str(user_id) / output_filename
-            
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            success = await asyncio.get_event_loop().run_in_executor(
-                None,
-                bot_data.merger.create_merged_fb2,
-                sorted_books,
-                str(output_path),
-                series_title
+            success = await run_in_merge_pool(merge_to_file, snapshot, output_path)
+        finally:
+            # Спул больше не читается, /clear может удалять файлы сессии
+            session.release_snapshot()
+        
+        await processing_msg.delete()
+        
+        if success:
+            document = FSInputFile(output_path, filename=output_filename)
+            await message.answer_document(
+                document,
+                caption=f"📚 {snapshot.series_title}\nОбъединено книг: {len(snapshot.books)}"
             )
-            
-            await processing_msg.delete()
-            
-            if success and output_path.exists():
-                document = FSInputFile(output_path, filename=output_filename)
-                await message.answer_document(
-                    document,
-                    caption=f"📚 {series_title}\nОбъединено книг: {len(sorted_books)}"
-                )
 
-                output_path.unlink()
+            await run_in_io_pool(partial(output_path.unlink, missing_ok=True))
 
-                await update_or_create_status(chat_id, session)
-                
-            else:
-                await message.answer(
-                    "❌ Ошибка при создании файла.",
-                    reply_markup=get_main_reply_keyboard()
-                )
+            await bot_data.status_updater.refresh(user_id, chat_id)
             
-        except Exception as e:
+        else:
             await message.answer(
-                f"❌ Ошибка: {str(e)}",
+                "❌ Ошибка при создании файла.",
                 reply_markup=get_main_reply_keyboard()
             )
+        
+    except Exception as e:
+        await message.answer(
+            f"❌ Ошибка: {str(e)}",
+            reply_markup=get_main_reply_keyboard()
+        )
+    
+    finally:
+        session.merging = False
 
 @router.message(F.text == "📝 Сортировать книги")
 async def handle_sort_reply(message: Message, state: FSMContext):
@@ -390,7 +448,7 @@ async def handle_sort_reply(message: Message, state: FSMContext):
     
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
+    async with user_lock.read():
         session = get_or_create_session(user_id)
         
         if not session.book_contents:
@@ -415,8 +473,9 @@ async def handle_sort_reply(message: Message, state: FSMContext):
             f"📚 Текущий порядок:\n\n{books_list}\n\n"
             f"Введите новый порядок цифрами через пробел:\n"
             f"Пример: 2 1 3 или 3 2 1\n\n"
-            f"ℹ️ Введите номера книг в нужном порядке",
-            reply_markup=get_cancel_reply_keyboard()
+            f"ℹ️ Введите номера книг в нужном порядке или нажмите «🔢 Авто-сортировка», "
+            f"чтобы расставить книги по номерам в серии",
+            reply_markup=get_sort_reply_keyboard()
         )
 
 @router.message(F.text == "✏️ Назвать сборник")
@@ -425,7 +484,7 @@ async def handle_name_reply(message: Message, state: FSMContext):
     
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
+    async with user_lock.read():
         session = get_or_create_session(user_id)
         
         if not session.book_contents:
@@ -459,6 +518,7 @@ async def handle_help_reply(message: Message):
 Доступные действия:
 📚 Слить книги - объединить все книги в один FB2
 📝 Сортировать книги - изменить порядок книг
+🔢 Авто-сортировка - по номерам книг в серии
 ✏️ Назвать сборник - задать название для сборника
 📋 Список книг - показать все загруженные книги
 🗑️ Очистить сессию - удалить все загруженные книги
@@ -479,9 +539,7 @@ async def handle_clear_reply(message: Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    user_lock = get_or_create_lock(user_id)
-    
-    async with user_lock:
+    async with clearing_session(user_id):
         session = get_or_create_session(user_id)
 
         if session.status_message_id:
@@ -493,7 +551,7 @@ async def handle_clear_reply(message: Message):
             except Exception:
                 pass
 
-        cleanup_user_session(user_id)
+        await cleanup_user_session(user_id)
 
         session = get_or_create_session(user_id)
         
@@ -508,31 +566,53 @@ async def handle_list_reply(message: Message):
     
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
+    async with user_lock.read():
         session = get_or_create_session(user_id)
         
         if not session.book_contents:
-            await message.answer(
-                "📭 Нет загруженных книг.",
-                reply_markup=get_main_reply_keyboard()
-            )
-            return
-        
-        books_list = "\n".join([f"{i+1}. {book.title}" for i, book in enumerate(session.book_contents)])
-        memory_usage = session.get_memory_usage() // (1024*1024)
-        
-        response = f"""📚 Статистика:
+            response = "📭 Нет загруженных книг."
+        else:
+            books_list = "\n".join([f"{i+1}. {book.title}" for i, book in enumerate(session.book_contents)])
+            memory_usage = session.get_memory_usage() // (1024*1024)
+            
+            response = f"""📚 Статистика:
 • Книг: {len(session.book_contents)}
 • Память: ~{memory_usage} MB
 • Название: {session.get_series_title()}
 
 Список книг по порядку:
 {books_list}"""
+    
+    await message.answer(
+        response,
+        reply_markup=get_main_reply_keyboard()
+    )
+
+async def apply_auto_sort(user_id: int, chat_id: int) -> str:
+    session = get_or_create_session(user_id)
+    
+    if len(session.book_contents) < 2:
+        return "ℹ️ Сортировать нечего."
+    
+    # Ключи сняты при разборе, книги не перечитываются; статус обновляется только при изменении порядка
+    if not session.auto_sort():
+        return "ℹ️ Книги уже стоят по порядку серии."
+    
+    await bot_data.status_updater.refresh(user_id, chat_id)
+    return "✅ Книги расставлены по номерам в серии."
+
+@router.message(F.text == "🔢 Авто-сортировка")
+async def handle_auto_sort_reply(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    
+    user_lock = get_or_create_lock(user_id)
+    
+    async with user_lock.write():
+        if await state.get_state() == BookStates.sorting:
+            await state.clear()
         
-        await message.answer(
-            response,
-            reply_markup=get_main_reply_keyboard()
-        )
+        result = await apply_auto_sort(user_id, message.chat.id)
+        await message.answer(result, reply_markup=get_main_reply_keyboard())
 
 @router.message(F.text == "❌ Отмена")
 async def handle_cancel_reply(message: Message, state: FSMContext):
@@ -558,50 +638,51 @@ async def handle_merge_callback(callback: CallbackQuery):
     
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
+    async with user_lock.write():
         session = get_or_create_session(user_id)
         
+        refusal = None
         if len(session.book_contents) < 2:
-            await callback.answer("❌ Нужно как минимум 2 книги для слияния.", show_alert=True)
-            return
-        
+            refusal = "❌ Нужно как минимум 2 книги для слияния."
+        elif session.merging:
+            refusal = "⏳ Сборник уже собирается, дождитесь файла."
+        else:
+            snapshot = session.snapshot()
+            session.merging = True
+    
+    if refusal:
+        await callback.answer(refusal, show_alert=True)
+        return
+    
+    try:
         try:
             await callback.answer("🔄 Начинаю слияние книг...")
             
-            sorted_books = session.get_sorted_books()
-            series_title = session.get_series_title()
-
-            safe_title = "".join(c for c in series_title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            output_filename = f"{safe_title}.fb2"
-            output_path = Path(bot_data.config.TEMP_DIR) / str(user_id) / output_filename
-
-            output_path.parent.mkdir(parents=True, exist_ok=True)
+            output_filename, output_path = get_merge_output(user_id, snapshot.series_title)
 
-            success = await asyncio.get_event_loop().run_in_executor(
-                None,
-                bot_data.merger.create_merged_fb2,
-                sorted_books,
-                str(output_path),
-                series_title
+            success = await run_in_merge_pool(merge_to_file, snapshot, output_path)
+        finally:
+            # Спул больше не читается, /clear может удалять файлы сессии
+            session.release_snapshot()
+        
+        if success:
+            document = FSInputFile(output_path, filename=output_filename)
+            await callback.message.answer_document(
+                document,
+                caption=f"📚 {snapshot.series_title}\nОбъединено книг: {len(snapshot.books)}"
             )
-            
-            if success and output_path.exists():
-                document = FSInputFile(output_path, filename=output_filename)
-                await callback.message.answer_document(
-                    document,
-                    caption=f"📚 {series_title}\nОбъединено книг: {len(sorted_books)}"
-                )
 
-                output_path.unlink()
-                
-            else:
-                await callback.message.answer("❌ Ошибка при создании файла.")
+            await run_in_io_pool(partial(output_path.unlink, missing_ok=True))
             
-        except Exception as e:
-            await callback.message.answer(f"❌ Ошибка: {str(e)}")
+        else:
+            await callback.message.answer("❌ Ошибка при создании файла.")
         
-        finally:
-            await update_or_create_status(chat_id, session)
+    except Exception as e:
+        await callback.message.answer(f"❌ Ошибка: {str(e)}")
+    
+    finally:
+        session.merging = False
+        await bot_data.status_updater.refresh(user_id, chat_id)
 
 @router.callback_query(F.data == "sort_books")
 async def handle_sort_callback(callback: CallbackQuery, state: FSMContext):
@@ -610,7 +691,7 @@ async def handle_sort_callback(callback: CallbackQuery, state: FSMContext):
     
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
+    async with user_lock.read():
         session = get_or_create_session(user_id)
         
         if not session.book_contents:
@@ -626,14 +707,26 @@ async def handle_sort_callback(callback: CallbackQuery, state: FSMContext):
             text=f"📚 Текущий порядок:\n\n{books_list}\n\n"
                 f"Введите новый порядок цифрами через пробел:\n"
                 f"Пример: 1 3 2\n\n"
+                f"🔢 Напишите 'авто', чтобы расставить книги по номерам в серии\n"
                 f"❌ Для отмены напишите 'отмена' или используйте кнопку",
-            reply_markup=get_cancel_reply_keyboard()
+            reply_markup=get_sort_reply_keyboard()
         )
 
         await state.update_data(instruction_msg_id=instruction_msg.message_id)
     
     await callback.answer()
 
+@router.callback_query(F.data == "auto_sort_books")
+async def handle_auto_sort_callback(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    
+    user_lock = get_or_create_lock(user_id)
+    
+    async with user_lock.write():
+        result = await apply_auto_sort(user_id, callback.message.chat.id)
+    
+    await callback.answer(result)
+
 @router.callback_query(F.data == "name_collection")
 async def handle_name_callback(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
@@ -641,7 +734,7 @@ async def handle_name_callback(callback: CallbackQuery, state: FSMContext):
     
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
+    async with user_lock.read():
         session = get_or_create_session(user_id)
         
         if not session.book_contents:
@@ -677,6 +770,7 @@ async def handle_help_callback(callback: CallbackQuery):
 Доступные действия:
 📚 Слить книги - объединить все книги в один FB2
 📝 Сортировать книги - изменить порядок книг
+🔢 Авто-сортировка - по номерам книг в серии
 ✏️ Назвать сборник - задать название для сборника
 🗑️ Очистить сессию - удалить все загруженные книги"""
     
@@ -688,9 +782,7 @@ async def handle_clear_callback(callback: CallbackQuery):
     user_id = callback.from_user.id
     chat_id = callback.message.chat.id
     
-    user_lock = get_or_create_lock(user_id)
-    
-    async with user_lock:
+    async with clearing_session(user_id):
         session = get_or_create_session(user_id)
         
         if session.status_message_id:
@@ -702,7 +794,7 @@ async def handle_clear_callback(callback: CallbackQuery):
             except Exception:
                 pass
         
-        cleanup_user_session(user_id)
+        await cleanup_user_session(user_id)
 
         session = get_or_create_session(user_id)
         
@@ -718,7 +810,7 @@ async def handle_text_message(message: Message, state: FSMContext):
     
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
+    async with user_lock.write():
         current_state = await state.get_state()
         session = get_or_create_session(user_id)
         
@@ -731,6 +823,12 @@ async def handle_text_message(message: Message, state: FSMContext):
                 )
                 return
             
+            if text == "авто":
+                await state.clear()
+                result = await apply_auto_sort(user_id, chat_id)
+                await message.answer(result, reply_markup=get_main_reply_keyboard())
+                return
+            
             try:
                 numbers = [int(n) for n in text.split()]
                 count = len(session.book_contents)
@@ -743,14 +841,11 @@ async def handle_text_message(message: Message, state: FSMContext):
                     return
                 
                 new_order = [session.book_contents[i - 1] for i in numbers]
-                session.book_contents = new_order
-                
-                for i, book in enumerate(session.book_contents):
-                    book.sort_order = i
+                session.set_book_order(new_order)
                 
                 await state.clear()
 
-                await update_or_create_status(chat_id, session)
+                await bot_data.status_updater.refresh(user_id, chat_id)
                 await message.answer(
                     "✅ Порядок книг изменен!",
                     reply_markup=get_main_reply_keyboard()
@@ -790,7 +885,7 @@ async def handle_text_message(message: Message, state: FSMContext):
                 )
             
             await state.clear()
-            await update_or_create_status(chat_id, session)
+            await bot_data.status_updater.refresh(user_id, chat_id)
 
         elif text.startswith('/'):
             pass
@@ -800,84 +895,100 @@ async def handle_text_message(message: Message, state: FSMContext):
                 reply_markup=get_main_reply_keyboard()
             )
 
-@router.message(F.document)
-async def handle_document(message: Message):
-    user_id = message.from_user.id
-    chat_id = message.chat.id
-    
+async def commit_ready_uploads(user_id: int, chat_id: int, queue: 'UserIngestQueue'):
     user_lock = get_or_create_lock(user_id)
     
-    async with user_lock:
-        session = get_or_create_session(user_id)
-        document = message.document
+    async with user_lock.write():
+        ready = queue.pop_ready()
         
-        if not document.file_name or not bot_data.archive_handler.is_supported_file(document.file_name):
-            supported = ", ".join(bot_data.archive_handler.supported_formats)
-            await message.answer(
-                f"❌ Неподдерживаемый формат. Поддерживаются: {supported}",
-                reply_markup=get_main_reply_keyboard()
-            )
+        if bot_data.ingest_queues.get(user_id) is not queue:
+            for upload in ready:
+                if upload.temp_dir:
+                    await get_workspace().remove(Path(upload.temp_dir))
             return
         
-        try:
-            processing_msg = await message.answer("⏳ Обрабатываю файл...")
-            
-            user_temp_dir = Path(bot_data.config.TEMP_DIR) / str(user_id)
-            user_temp_dir.mkdir(exist_ok=True)
-            
-            file_path = user_temp_dir / document.file_name
-            
-            await bot_data.config.bot.download(document, destination=file_path)
+        session = get_or_create_session(user_id)
+        session.pending_uploads = queue.pending_count()
+        
+        skipped = {}
+        for upload in ready:
+            if upload.temp_dir:
+                session.temp_dirs.append(upload.temp_dir)
             
-            book_contents, temp_dir = bot_data.archive_handler.extract_and_parse_file(
-                str(file_path), user_id
+            session.add_books(upload.books)
+            skipped[upload.seq] = session.fingerprints.pop_skipped(upload.seq)
+        
+        bot_data.status_updater.schedule(user_id, chat_id, move_to_bottom=True)
+    
+    # Книги уже в сессии; ответы по загрузкам отправляются без блокировки
+    for upload in ready:
+        if isinstance(upload.error, WorkspaceQuotaError):
+            await upload.message.answer(
+                f"💾 {upload.error}",
+                reply_markup=get_main_reply_keyboard()
             )
-            
-            if temp_dir:
-                session.temp_dirs.append(temp_dir)
-            
-            if file_path.exists():
-                file_path.unlink()
-            
-            await processing_msg.delete()
-            
-            if not book_contents:
-                await message.answer(
-                    "❌ FB2-книги не найдены",
-                    reply_markup=get_main_reply_keyboard()
-                )
-                return
-            
-            books_before = len(session.book_contents)
-            
-            current_time = datetime.now()
-            is_new_batch = False
-            
-            if books_before == 0:
-                is_new_batch = True
-            elif session.last_file_time:
-                time_since_last = current_time - session.last_file_time
-                if time_since_last > timedelta(seconds=2):
-                    is_new_batch = True
-                else:
-                    is_new_batch = False
-            else:
-                is_new_batch = True
-            
-            session.last_file_time = current_time
-            
-            start_order = len(session.book_contents)
-            for i, book in enumerate(book_contents):
-                book.sort_order = start_order + i
-                session.book_contents.append(book)
-            
-            if is_new_batch:
-                await create_status_message_at_bottom(chat_id, session)
-            else:
-                await update_or_create_status(chat_id, session, force_new=False)
-            
-        except Exception as e:
-            await message.answer(
-                f"❌ Ошибка обработки файла: {str(e)}",
+        elif upload.error:
+            await upload.message.answer(
+                f"❌ Ошибка обработки файла: {str(upload.error)}",
                 reply_markup=get_main_reply_keyboard()
             )
+        elif not upload.books and skipped[upload.seq]:
+            await upload.message.answer(
+                f"🔁 Все книги из файла уже загружены, пропущено дубликатов: {skipped[upload.seq]}",
+                reply_markup=get_main_reply_keyboard()
+            )
+        elif not upload.books:
+            await upload.message.answer(
+                "❌ FB2-книги не найдены",
+                reply_markup=get_main_reply_keyboard()
+            )
+
+@router.message(F.document)
+async def handle_document(message: Message):
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+    document = message.document
+    
+    # Место в очереди занимается до первого await: иначе файлы, пришедшие подряд,
+    # могли бы встать в очередь не в порядке сообщений
+    if not is_supported_upload(document.file_name):
+        supported = ", ".join(await run_in_io_pool(get_supported_formats))
+        await message.answer(
+            f"❌ Неподдерживаемый формат. Поддерживаются: {supported}",
+            reply_markup=get_main_reply_keyboard()
+        )
+        return
+    
+    queue = get_or_create_ingest_queue(user_id)
+    upload = queue.register(message)
+    
+    session = get_or_create_session(user_id)
+    session.pending_uploads = queue.pending_count()
+    bot_data.status_updater.schedule(user_id, chat_id, move_to_bottom=True)
+    
+    workspace = get_workspace()
+    user_temp_dir = workspace.user_dir(user_id)
+    if session.spool is None:
+        session.spool = Spool(user_temp_dir / "spool")
+    
+    try:
+        # Первый вызов импортирует lxml и ищет unrar/7z в PATH
+        archive_handler = await run_in_io_pool(get_archive_handler)
+        async with queue.semaphore, workspace.reserve(user_id, document.file_size or 0):
+            upload.books, upload.temp_dir = await ingest_document(
+                bot_data.bot_instance,
+                archive_handler,
+                document,
+                user_temp_dir,
+                user_id,
+                bot_data.config.SPOOL_MAX_MEMORY,
+                session.spool,
+                session.fingerprints.for_upload(upload.seq)
+            )
+    except Exception as e:
+        upload.error = e
+        session.fingerprints.release(upload.seq)
+    finally:
+        upload.done = True
+    
+    await commit_ready_uploads(user_id, chat_id, queue)
@@ -0,0 +1,66 @@
+import codecs
+import re
+from typing import Optional
+
+SAMPLE_SIZE = 64 * 1024
+DEFAULT_ENCODING = 'utf-8'
+LEGACY_ENCODING = 'cp1251'
+
+_XML_ENCODING_RE = re.compile(rb'^\s*<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._\-]+)["\']')
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def sniff_encoding(prefix: bytes) -> Optional[str]:
+    for bom, encoding in _BOMS:
+        if prefix.startswith(bom):
+            return encoding
+
+    match = _XML_ENCODING_RE.match(prefix)
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            return None
+
+    return None
+
+
+def _looks_like_utf8(sample: bytes) -> bool:
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        # final=False: обрезанный на границе выборки символ не считается ошибкой
+        decoder.decode(sample, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def detect_encoding(prefix: bytes) -> str:
+    declared = sniff_encoding(prefix)
+    if declared:
+        return declared
+
+    if _looks_like_utf8(prefix[:SAMPLE_SIZE]):
+        return DEFAULT_ENCODING
+    return LEGACY_ENCODING
+
+
+def parser_encoding(prefix: bytes) -> Optional[str]:
+    # lxml сам читает BOM и объявление, подсказка нужна только файлам без них
+    if sniff_encoding(prefix):
+        return None
+    encoding = detect_encoding(prefix)
+    return None if encoding == DEFAULT_ENCODING else encoding
+
+
+def decode_text(data) -> str:
+    encoding = detect_encoding(bytes(data[:SAMPLE_SIZE]))
+    try:
+        return str(data, encoding)
+    except (UnicodeDecodeError, LookupError):
+        return str(data, encoding if encoding != 'utf-16' else DEFAULT_ENCODING, errors='replace')
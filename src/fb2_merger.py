@@ -1,34 +1,39 @@
 import os
-import tempfile
-import shutil
-from pathlib import Path
-from src.models import BookContent, FB2Image
-from typing import List, Dict
-import xml.etree.ElementTree as ET
+from datetime import date
+from src.models import BookContent, BookSegment
+from src.book_metadata import Author, BookMetadata
+from src.file_assembly import FileAssembler
+from src.segments import FB2_NS, FB2_NSMAP, XLINK_NS, build_book_section, new_segment_token, render_segment
+from src.series import build_series_title
+from src.spool import Spool
+from src.xml_parsers import parse_fragment
+from typing import Optional
 from lxml import etree
-import base64
-import uuid
-import re
+
+FICTIONBOOK_OPEN = f'<FictionBook xmlns="{FB2_NS}" xmlns:xlink="{XLINK_NS}">\n'.encode('utf-8')
+
+def _fb(tag: str) -> str:
+    return f'{{{FB2_NS}}}{tag}'
 
 class FB2Merger:
     def __init__(self, max_memory_mb: int = 2048):
         self.max_memory_mb = max_memory_mb
         
-    def create_merged_fb2(self, book_contents: list[BookContent], output_path: str, series_title: str = None) -> bool:
+    def create_merged_fb2(self, book_contents: list[BookContent], output_path: str, series_title: str = None,
+                          spool: Optional[Spool] = None) -> bool:
         try:
             if not series_title:
-                from src.models import UserSession
-                temp_session = UserSession(user_id=0)
-                temp_session.book_contents = book_contents
-                series_title = temp_session.get_series_title()
+                series_title = build_series_title(book.title for book in book_contents)
             
-            all_images = self._collect_all_images(book_contents)
+            # Отрисовываются только книги без сегмента: после добавления пары книг, перестановки
+            # или переименования работа пропорциональна изменению, а не размеру сборника
+            segments = [self._get_segment(book_content, spool) for book_content in book_contents]
             
             success = self._create_clean_merged_fb2(
                 book_contents, 
+                segments,
                 output_path, 
-                series_title, 
-                all_images
+                series_title
             )
             
             if success and os.path.exists(output_path):
@@ -39,135 +44,129 @@ class FB2Merger:
         except Exception:
             return False
     
-    def _collect_all_images(self, book_contents: list[BookContent]) -> Dict[str, FB2Image]:
-        all_images = {}
-        image_counter = 1
-        
-        for book in book_contents:
-            for old_image_id, image in book.images.items():
-                new_image_id = f"img_{image_counter:04d}"
-                image_counter += 1
-                
-                actual_extension = image.detect_extension()
-                correct_content_type = image.get_correct_content_type()
-                
-                all_images[new_image_id] = FB2Image(
-                    id=new_image_id,
-                    content_type=correct_content_type,
-                    data=image.data,
-                    original_ref=image.original_ref,
-                    actual_extension=actual_extension
-                )
-                
-                if not hasattr(book, 'image_mapping'):
-                    book.image_mapping = {}
-                book.image_mapping[old_image_id] = new_image_id
-        
-        return all_images
+    def _get_segment(self, book_content: BookContent, spool: Optional[Spool]) -> BookSegment:
+        if book_content.segment is None:
+            book_content.segment = self._render_segment(book_content, spool)
+        return book_content.segment
+    
+    def _render_segment(self, book_content: BookContent, spool: Optional[Spool]) -> BookSegment:
+        # Обычно сегмент готовится ещё при разборе; сюда попадают книги, чей разбор не удался:
+        # картинок у них нет, тело берётся из исходного текста
+        token = new_segment_token()
+        book_section = build_book_section(book_content.title, book_content.metadata,
+                                          self._parse_body_elements(book_content))
+        return render_segment(book_section, {}, {}, token, spool)
     
-    def _create_clean_merged_fb2(self, book_contents: list[BookContent], 
-                                output_path: str, series_title: str, 
-                                all_images: Dict[str, FB2Image]) -> bool:
+    def _create_clean_merged_fb2(self, book_contents: list[BookContent], segments: list[BookSegment],
+                                output_path: str, series_title: str) -> bool:
         
         try:
-            nsmap = {
-                None: 'http://www.gribuser.ru/xml/fictionbook/2.0',
-                'xlink': 'http://www.w3.org/1999/xlink'
-            }
-            
-            root = etree.Element('FictionBook', nsmap=nsmap)
-            
-            description = etree.SubElement(root, 'description')
-            title_info = etree.SubElement(description, 'title-info')
-            
-            book_title = etree.SubElement(title_info, 'book-title')
-            book_title.text = series_title
-            
-            author = etree.SubElement(title_info, 'author')
-            first_name = etree.SubElement(author, 'first-name')
-            first_name.text = "Объединенный"
-            last_name = etree.SubElement(author, 'last-name')
-            last_name.text = "Сборник"
-            
-            annotation = etree.SubElement(title_info, 'annotation')
-            annotation_p = etree.SubElement(annotation, 'p')
-            annotation_p.text = f"Объединенный сборник из {len(book_contents)} книг"
-            
-            date = etree.SubElement(title_info, 'date')
-            date.text = "2024"
-            date.set('value', '2024')
-            
-            for image_id, image in all_images.items():
-                binary_elem = etree.Element('binary')
-                binary_elem.set('id', image_id)
-                binary_elem.set('content-type', image.content_type)
+            # Заново строится только описание, остальное - готовые сегменты в нужном порядке
+            description = etree.tostring(self._build_description(series_title, book_contents),
+                                         encoding='utf-8', pretty_print=True)
+            
+            # Сегменты из спула копируются ядром, Python пишет только склейку между ними
+            with open(output_path, 'wb', buffering=0) as f, FileAssembler(f.fileno()) as out:
+                out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+                out.write(FICTIONBOOK_OPEN)
+                out.write(description)
                 
-                try:
-                    image_data_base64 = base64.b64encode(image.data).decode('utf-8')
-                    binary_elem.text = image_data_base64
-                    
-                    root.append(binary_elem)
-                    
-                except Exception:
-                    continue
-            
-            body = etree.SubElement(root, 'body')
-            
-            for i, book_content in enumerate(book_contents):
-                book_section = etree.SubElement(body, 'section')
+                out.write(b'<body>\n')
+                for segment in segments:
+                    self._write_segment_part(out, segment, 0, segment.section_length)
+                out.write(b'</body>\n')
                 
-                book_body_content = self._get_clean_processed_content(book_content)
-                if book_body_content:
-                    try:
-                        book_parser = etree.XMLParser(recover=True)
-                        book_root = etree.fromstring(f"<root>{book_body_content}</root>".encode('utf-8'), book_parser)
-                        
-                        for elem in book_root:
-                            book_section.append(elem)
-                            
-                    except Exception:
-                        error_p = etree.Element('p')
-                        error_p.text = f"[Ошибка загрузки книги: {book_content.title}]"
-                        book_section.append(error_p)
-                else:
-                    empty_p = etree.Element('p')
-                    empty_p.text = f"[Содержимое книги '{book_content.title}' отсутствует]"
-                    book_section.append(empty_p)
-            
-            tree = etree.ElementTree(root)
-            
-            with open(output_path, 'wb') as f:
-                f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
-                tree.write(f, encoding='utf-8', pretty_print=True, xml_declaration=False)
+                for segment in segments:
+                    self._write_segment_part(out, segment, segment.section_length, segment.length)
+                out.write(b'</FictionBook>\n')
             
             return True
             
         except Exception:
             return False
     
-    def _get_clean_processed_content(self, book_content: BookContent) -> str:
+    def _write_segment_part(self, out: FileAssembler, segment: BookSegment, start: int, end: int):
+        if segment.payload is not None:
+            out.copy(segment.payload.path, segment.payload.offset + start, end - start)
+        elif segment.inline_data is not None:
+            out.write(segment.inline_data[start:end])
+    
+    def _build_description(self, series_title: str, book_contents: list[BookContent]):
+        description = etree.Element(_fb('description'), nsmap=FB2_NSMAP)
+        title_info = etree.SubElement(description, _fb('title-info'))
+        metadata = [book.metadata for book in book_contents if book.metadata is not None]
+        
+        genres = dict.fromkeys(genre for item in metadata for genre in item.genres) or ['prose']
+        for genre in genres:
+            etree.SubElement(title_info, _fb('genre')).text = genre
+        
+        authors = self._collect_authors(metadata) or [Author(first_name="Объединенный", last_name="Сборник")]
+        for author in authors:
+            self._build_author(title_info, author)
+        
+        book_title = etree.SubElement(title_info, _fb('book-title'))
+        book_title.text = series_title
+        
+        annotation = etree.SubElement(title_info, _fb('annotation'))
+        annotation_p = etree.SubElement(annotation, _fb('p'))
+        annotation_p.text = f"Объединенный сборник из {len(book_contents)} книг"
+        for index, book in enumerate(book_contents, 1):
+            etree.SubElement(annotation, _fb('p')).text = f"{index}. {book.title}"
+        
+        today = date.today()
+        date_elem = etree.SubElement(title_info, _fb('date'))
+        date_elem.text = str(today.year)
+        date_elem.set('value', today.isoformat())
+        
+        cover_id = self._find_cover_id(book_contents)
+        if cover_id:
+            coverpage = etree.SubElement(title_info, _fb('coverpage'))
+            etree.SubElement(coverpage, _fb('image')).set(f'{{{XLINK_NS}}}href', f'#{cover_id}')
+        
+        lang = next((item.lang for item in metadata if item.lang), 'ru')
+        etree.SubElement(title_info, _fb('lang')).text = lang
+        
+        for sequence_name in dict.fromkeys(item.sequence_name for item in metadata if item.sequence_name):
+            etree.SubElement(title_info, _fb('sequence')).set('name', sequence_name)
+        
+        return description
+    
+    def _collect_authors(self, metadata: list[BookMetadata]) -> list[Author]:
+        authors = {}
+        for item in metadata:
+            for author in item.authors:
+                authors.setdefault(author.key, author)
+        return list(authors.values())
+    
+    def _build_author(self, parent, author: Author):
+        author_elem = etree.SubElement(parent, _fb('author'))
+        for tag, value in (('first-name', author.first_name), ('middle-name', author.middle_name),
+                           ('last-name', author.last_name), ('nickname', author.nickname)):
+            if value:
+                etree.SubElement(author_elem, _fb(tag)).text = value
+    
+    def _find_cover_id(self, book_contents: list[BookContent]) -> str:
+        # Обложкой сборника становится обложка первой книги, у которой она есть
+        for book in book_contents:
+            if book.metadata is not None and book.segment is not None and book.metadata.cover_image_id in book.images:
+                return f"{book.segment.token}_{book.metadata.cover_image_id}"
+        return ""
+    
+    def _parse_body_elements(self, book_content: BookContent) -> list:
+        book_body_content = self._clean_body_content(book_content.content) if book_content.content else ""
+        if not book_body_content:
+            return []
+        
         try:
-            if hasattr(book_content, 'processed_content') and book_content.processed_content:
-                content = book_content.processed_content
-                
-                content = self._clean_body_content(content)
-                
-                if hasattr(book_content, 'image_mapping'):
-                    for old_id, new_id in book_content.image_mapping.items():
-                        content = content.replace(f'@@IMAGE_{old_id}@@', f'#{new_id}')
-                
-                return content
-            else:
-                content = book_content.content
-                return self._clean_body_content(content) if content else ""
-                
+            return list(parse_fragment(book_body_content))
         except Exception:
-            return book_content.content if book_content.content else ""
+            error_p = etree.Element(_fb('p'))
+            error_p.text = f"[Ошибка загрузки книги: {book_content.title}]"
+            return [error_p]
     
     def _clean_body_content(self, content: str) -> str:
         try:
-            parser = etree.XMLParser(recover=True)
-            root = etree.fromstring(f"<root>{content}</root>".encode('utf-8'), parser)
+            root = parse_fragment(content)
             
             binary_elems = root.xpath('//binary')
             for binary_elem in binary_elems:
@@ -198,8 +197,3 @@ class FB2Merger:
         
         base64_ratio = len([c for c in text if c in base64_chars]) / len(text)
         return base64_ratio > 0.9
-
-    def _ensure_books_content_loaded(self, book_contents: list[BookContent]):
-        for book in book_contents:
-            if not book.content and book.file_path:
-                book.load_content_from_file()
@@ -0,0 +1,106 @@
+import errno
+import os
+from typing import Dict, List
+
+# Больше IOV_MAX кусков writev не принимает; 1024 - минимум на Linux и macOS
+WRITEV_MAX_PARTS = 1024
+GLUE_FLUSH_SIZE = 256 * 1024
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+# Ошибки, после которых ядро этот способ копирования для пары файлов не поддерживает
+_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP}
+
+
+class FileAssembler:
+    # Файл собирается из диапазонов других файлов без проезда данных через Python:
+    # copy_file_range (копирование внутри ядра, на CoW-ФС - просто ссылки на блоки),
+    # затем sendfile, затем обычные pread/write. Мелкие куски XML между диапазонами
+    # копятся в буфере и уходят одним writev
+    def __init__(self, fd: int):
+        self._fd = fd
+        self._glue: List[bytes] = []
+        self._glue_size = 0
+        self._sources: Dict[str, int] = {}
+        self._copy_file_range = hasattr(os, 'copy_file_range')
+        self._sendfile = hasattr(os, 'sendfile')
+        self.written = 0
+
+    def __enter__(self) -> 'FileAssembler':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.close()
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        self._glue.append(data)
+        self._glue_size += len(data)
+        if self._glue_size >= GLUE_FLUSH_SIZE or len(self._glue) >= WRITEV_MAX_PARTS:
+            self.flush()
+
+    def flush(self):
+        parts, self._glue, self._glue_size = self._glue, [], 0
+        while parts:
+            written = os.writev(self._fd, parts[:WRITEV_MAX_PARTS])
+            self.written += written
+            parts = self._drop_written(parts, written)
+
+    def _drop_written(self, parts: List[bytes], written: int) -> List[bytes]:
+        # writev имеет право записать не всё: недописанный хвост остаётся в начале списка
+        index = 0
+        while index < len(parts) and written >= len(parts[index]):
+            written -= len(parts[index])
+            index += 1
+        rest = parts[index:]
+        if rest and written:
+            rest[0] = rest[0][written:]
+        return rest
+
+    def copy(self, path: str, offset: int, length: int):
+        if length <= 0:
+            return
+        self.flush()
+
+        source = self._sources.get(path)
+        if source is None:
+            source = self._sources[path] = os.open(path, os.O_RDONLY)
+
+        end = offset + length
+        while offset < end:
+            copied = self._copy_chunk(source, offset, min(end - offset, COPY_CHUNK_SIZE))
+            if copied == 0:
+                raise EOFError(f"{os.path.basename(path)} короче ожидаемого")
+            offset += copied
+            self.written += copied
+
+    def _copy_chunk(self, source: int, offset: int, count: int) -> int:
+        if self._copy_file_range:
+            try:
+                return os.copy_file_range(source, self._fd, count, offset)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self._copy_file_range = False
+
+        if self._sendfile:
+            try:
+                return os.sendfile(self._fd, source, offset, count)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self._sendfile = False
+
+        data = memoryview(os.pread(source, min(count, COPY_CHUNK_SIZE), offset))
+        copied = len(data)
+        while data:
+            data = data[os.write(self._fd, data):]
+        return copied
+
+    def close(self):
+        for source in self._sources.values():
+            os.close(source)
+        self._sources.clear()
@@ -0,0 +1,129 @@
+import hashlib
+import heapq
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+FB2_NS = {'fb': 'http://www.gribuser.ru/xml/fictionbook/2.0'}
+SKETCH_SIZE = 128
+NEAR_DUPLICATE_SIMILARITY = 0.8
+
+
+@dataclass(slots=True, frozen=True)
+class BookFingerprint:
+    body_digest: str
+    title_key: str
+    sketch: Tuple[int, ...]
+
+    @property
+    def key(self) -> Optional[Tuple[str, str]]:
+        # Пустой текст или пустой title-info (например, FB2 без пространства имён) у разных книг
+        # совпадает, поэтому такие книги в точное совпадение не попадают
+        if not self.body_digest or not self.title_key:
+            return None
+        return self.body_digest, self.title_key
+
+
+@dataclass(slots=True, frozen=True)
+class DuplicateCheck:
+    duplicate: bool = False
+    similar_to: str = ""
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+def _title_key(root) -> str:
+    title_info = root.find('.//fb:description/fb:title-info', namespaces=FB2_NS)
+    if title_info is None:
+        return ""
+
+    parts = []
+    for path in ('fb:book-title', 'fb:author', 'fb:sequence'):
+        for elem in title_info.findall(path, namespaces=FB2_NS):
+            parts.append(_normalize(' '.join(elem.itertext())))
+            parts.extend(f"{name}={value}" for name, value in sorted(elem.attrib.items()))
+    return '|'.join(parts)
+
+
+def _sketch(fragments: List[str]) -> Tuple[int, ...]:
+    # Шинглы - текстовые узлы тела: правка пары абзацев почти не меняет набор.
+    # hash() строк случаен между процессами, но сессии живут только в памяти одного процесса
+    shingles = {hash(fragment) for fragment in (text.strip().lower() for text in fragments) if fragment}
+    return tuple(heapq.nsmallest(SKETCH_SIZE, shingles))
+
+
+def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    if not first or not second:
+        return 0.0
+
+    first_set, second_set = set(first), set(second)
+    union = heapq.nsmallest(SKETCH_SIZE, first_set | second_set)
+    common = first_set & second_set
+    return sum(1 for value in union if value in common) / len(union)
+
+
+def fingerprint_book(root) -> Optional[BookFingerprint]:
+    try:
+        fragments = root.xpath('fb:body//text()', namespaces=FB2_NS, smart_strings=False)
+        text = _normalize(' '.join(fragments))
+        body_digest = hashlib.sha1(text.encode('utf-8')).hexdigest() if text else ""
+        return BookFingerprint(body_digest, _title_key(root), _sketch(fragments))
+    except Exception:
+        return None
+
+
+class FingerprintRegistry:
+    # Одна на сессию; книги из разных загрузок разбираются параллельно, поэтому под замком
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owners: Dict[Tuple[str, str], int] = {}
+        self._books: List[Tuple[BookFingerprint, str, int]] = []
+        self._skipped: Dict[int, int] = {}
+        self.skipped_total = 0
+
+    def check(self, fingerprint: BookFingerprint, title: str, owner: int) -> DuplicateCheck:
+        with self._lock:
+            key = fingerprint.key
+            if key is not None and key in self._owners:
+                self._skipped[owner] = self._skipped.get(owner, 0) + 1
+                self.skipped_total += 1
+                return DuplicateCheck(duplicate=True)
+
+            similar_to = ""
+            for known, known_title, _ in self._books:
+                if (fingerprint.title_key and known.title_key == fingerprint.title_key) or \
+                        similarity(fingerprint.sketch, known.sketch) >= NEAR_DUPLICATE_SIMILARITY:
+                    similar_to = known_title
+                    break
+
+            if key is not None:
+                self._owners[key] = owner
+            self._books.append((fingerprint, title, owner))
+            return DuplicateCheck(similar_to=similar_to)
+
+    def release(self, owner: int):
+        # Загрузка упала: её книги не попали в сессию и не должны считаться дубликатами
+        with self._lock:
+            self._owners = {key: value for key, value in self._owners.items() if value != owner}
+            self._books = [entry for entry in self._books if entry[2] != owner]
+            self.skipped_total -= self._skipped.pop(owner, 0)
+
+    def pop_skipped(self, owner: int) -> int:
+        with self._lock:
+            return self._skipped.pop(owner, 0)
+
+    def for_upload(self, owner: int) -> 'UploadFingerprints':
+        return UploadFingerprints(self, owner)
+
+
+class UploadFingerprints:
+    def __init__(self, registry: FingerprintRegistry, owner: int):
+        self.registry = registry
+        self.owner = owner
+
+    def check(self, fingerprint: Optional[BookFingerprint], title: str) -> DuplicateCheck:
+        if fingerprint is None:
+            return DuplicateCheck()
+        return self.registry.check(fingerprint, title, self.owner)
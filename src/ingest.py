@@ -0,0 +1,191 @@
+import asyncio
+import queue
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiofiles
+from aiogram import Bot
+from aiogram.types import Document, Message
+
+from src.models import BookContent
+from src.fingerprint import UploadFingerprints
+from src.spool import Spool
+from src.workers import run_in_archive_pool, run_in_io_pool, run_in_stream_pool
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Сколько кусков загрузки может ждать разбора: при отставании разбора загрузка притормаживает
+STREAM_QUEUE_CHUNKS = 64
+STREAM_PUT_INTERVAL = 0.01
+
+
+def is_supported_upload(filename: Optional[str]) -> bool:
+    # Только проверка имени, без поиска unrar и 7z: отсутствие инструмента выяснится при разборе,
+    # и ошибка придёт пользователю в порядке загрузок
+    from src.archive_walker import archive_kind, is_fb2_name
+    return bool(filename) and (is_fb2_name(filename) or archive_kind(filename) is not None)
+
+
+@dataclass
+class PendingUpload:
+    seq: int
+    message: Message
+    books: List[BookContent] = field(default_factory=list)
+    temp_dir: str = ""
+    error: Optional[Exception] = None
+    done: bool = False
+
+
+class UserIngestQueue:
+    def __init__(self, max_parallel: int):
+        self.semaphore = asyncio.Semaphore(max_parallel)
+        self._uploads: Dict[int, PendingUpload] = {}
+        self._next_seq = 0
+        self._next_commit = 0
+
+    def register(self, message: Message) -> PendingUpload:
+        upload = PendingUpload(seq=self._next_seq, message=message)
+        self._uploads[upload.seq] = upload
+        self._next_seq += 1
+        return upload
+
+    def pop_ready(self) -> List[PendingUpload]:
+        ready = []
+        while self._next_commit in self._uploads and self._uploads[self._next_commit].done:
+            ready.append(self._uploads.pop(self._next_commit))
+            self._next_commit += 1
+        return ready
+
+    def pending_count(self) -> int:
+        return len(self._uploads)
+
+
+async def iter_document_chunks(bot: Bot, document: Document,
+                               chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    file = await bot.get_file(document.file_id)
+
+    if bot.session.api.is_local:
+        local_path = bot.session.api.wrap_local_file.to_local(file.file_path)
+        async with aiofiles.open(local_path, 'rb') as f:
+            while chunk := await f.read(chunk_size):
+                yield chunk
+        return
+
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    async for chunk in bot.session.stream_content(url=url, chunk_size=chunk_size, raise_for_status=True):
+        yield chunk
+
+
+async def _put_chunk(chunks: queue.Queue, chunk: Optional[bytes], parse_task: asyncio.Future) -> bool:
+    # Очередь ограничена, а ждать её в цикле событий нельзя: место проверяется с паузами.
+    # False - разбор уже закончился, и кусок никому не нужен
+    while True:
+        if parse_task.done():
+            return False
+        try:
+            chunks.put_nowait(chunk)
+            return True
+        except queue.Full:
+            await asyncio.sleep(STREAM_PUT_INTERVAL)
+
+
+def _abort_reader(chunks: queue.Queue):
+    # Поток разбора отменить нельзя: он завершится, получив конец файла
+    while True:
+        try:
+            chunks.get_nowait()
+        except queue.Empty:
+            break
+    chunks.put_nowait(None)
+
+
+async def _stream_chunks(bot: Bot, document: Document, run_in_pool: Callable[..., Awaitable[Any]],
+                         func: Callable[..., Any], *args) -> Any:
+    # Разбор идёт параллельно загрузке: func читает куски из очереди, None - конец файла.
+    # Поток, ждущий сеть, берётся из пула потоковых загрузок, а не из пула разбора
+    chunks: queue.Queue = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+    parse_task = asyncio.ensure_future(run_in_pool(func, chunks, document.file_name, *args))
+    download = iter_document_chunks(bot, document)
+
+    try:
+        async for chunk in download:
+            if not await _put_chunk(chunks, chunk, parse_task):
+                # Разбор уже закончился (обычно ошибкой): остаток файла не качается
+                break
+        await _put_chunk(chunks, None, parse_task)
+    except BaseException:
+        parse_task.cancel()
+        _abort_reader(chunks)
+        raise
+    finally:
+        await download.aclose()
+
+    return await parse_task
+
+
+async def _stream_fb2(bot: Bot, archive_handler: 'ArchiveHandler', document: Document,
+                      spool: Spool, fingerprints: UploadFingerprints) -> List[BookContent]:
+    book_content = await _stream_chunks(bot, document, run_in_stream_pool, archive_handler.parse_fb2_chunks,
+                                        spool, fingerprints)
+    return [book_content] if book_content else []
+
+
+async def _stream_tar(bot: Bot, archive_handler: 'ArchiveHandler', document: Document,
+                      spool: Spool, fingerprints: UploadFingerprints) -> List[BookContent]:
+    return await _stream_chunks(bot, document, run_in_stream_pool, archive_handler.parse_archive_chunks,
+                                spool, fingerprints)
+
+
+async def _stream_to_buffer(bot: Bot, archive_handler: 'ArchiveHandler', document: Document,
+                            user_temp_dir: Path, spool_max_memory: int, spool: Spool,
+                            fingerprints: UploadFingerprints) -> List[BookContent]:
+    # Небольшие архивы целиком остаются в памяти, крупные уходят во временный файл
+    with tempfile.SpooledTemporaryFile(max_size=spool_max_memory, dir=user_temp_dir) as buffer:
+        size = 0
+        async for chunk in iter_document_chunks(bot, document):
+            # После перехода на диск запись может ждать ФС, поэтому она идёт в пуле
+            await run_in_io_pool(buffer.write, chunk)
+            size += len(chunk)
+        buffer.seek(0)
+        # Буфер переходит на диск, как только размер превысит max_size; такой файл можно отобразить в память
+        return await run_in_archive_pool(archive_handler.extract_and_parse_stream, buffer, document.file_name,
+                                         spool, fingerprints, size > spool_max_memory)
+
+
+async def _download_to_disk(bot: Bot, archive_handler: 'ArchiveHandler', document: Document,
+                            user_temp_dir: Path, user_id: int, spool: Spool,
+                            fingerprints: UploadFingerprints) -> Tuple[List[BookContent], str]:
+    download_dir = await run_in_io_pool(partial(tempfile.mkdtemp, dir=user_temp_dir))
+    file_path = Path(download_dir) / document.file_name
+
+    try:
+        await bot.download(document, destination=file_path)
+        return await run_in_archive_pool(archive_handler.extract_and_parse_file, str(file_path), user_id,
+                                         spool, fingerprints)
+    finally:
+        await run_in_io_pool(shutil.rmtree, download_dir, True)
+
+
+async def ingest_document(bot: Bot, archive_handler: 'ArchiveHandler', document: Document,
+                          user_temp_dir: Path, user_id: int,
+                          spool_max_memory: int, spool: Spool,
+                          fingerprints: UploadFingerprints) -> Tuple[List[BookContent], str]:
+    from src.archive_walker import archive_kind
+
+    await run_in_io_pool(partial(user_temp_dir.mkdir, parents=True, exist_ok=True))
+    file_ext = Path(document.file_name).suffix.lower()
+
+    if file_ext == '.fb2':
+        return await _stream_fb2(bot, archive_handler, document, spool, fingerprints), ""
+
+    if archive_kind(document.file_name) == 'tar':
+        return await _stream_tar(bot, archive_handler, document, spool, fingerprints), ""
+
+    if file_ext == '.zip':
+        return await _stream_to_buffer(bot, archive_handler, document, user_temp_dir,
+                                       spool_max_memory, spool, fingerprints), ""
+
+    return await _download_to_disk(bot, archive_handler, document, user_temp_dir, user_id, spool, fingerprints)
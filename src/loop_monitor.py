@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(PROJECT_ROOT, 'src') + os.sep
+# Обёртки вокруг обработчиков: виноват не middleware, а то, что он вызвал
+_PLUMBING = {__file__, os.path.join(SRC_DIR, 'metrics.py')}
+
+
+def _describe(frame) -> str:
+    filename = os.path.relpath(frame.f_code.co_filename, PROJECT_ROOT)
+    return f"{frame.f_code.co_name} ({filename}:{frame.f_lineno})"
+
+
+def blocking_call_site(frame) -> Tuple[Optional[str], Optional[str]]:
+    # Внешний кадр из src/ - обработчик, внутренний - строка, которая держит цикл
+    outer = inner = None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(SRC_DIR) and filename not in _PLUMBING:
+            outer = frame
+            if inner is None:
+                inner = frame
+        frame = frame.f_back
+    if outer is None:
+        return None, None
+    return _describe(outer), _describe(inner)
+
+
+class LoopLagMonitor:
+    # Корутина-пульс раз в interval отмечается в цикле событий. Если отметки нет дольше threshold,
+    # сторожевой поток снимает стек потока цикла, пока тот ещё занят, и запоминает,
+    # какой обработчик его держит. Предупреждение пишется, когда цикл освободится
+    def __init__(self, threshold: float, interval: float = 0.1, histogram: Optional['Histogram'] = None):
+        self.threshold = threshold
+        self.interval = interval
+        self.histogram = histogram
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        # (отметка пульса, после которой цикл встал; обработчик; строка)
+        self._culprit: Optional[Tuple[float, Optional[str], Optional[str]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            beat, self._last_beat = self._last_beat, now
+            lag = max(0.0, now - beat - self.interval)
+            self.max_lag = max(self.max_lag, lag)
+            if self.histogram is not None:
+                self.histogram.observe(lag)
+            if lag >= self.threshold:
+                self._report(beat, lag)
+
+    def _report(self, beat: float, lag: float):
+        self.stalls += 1
+        culprit, self._culprit = self._culprit, None
+        # Снимок от прошлой остановки, опоздавший к своему отчёту, не приписывается этой
+        handler, location = culprit[1:] if culprit and culprit[0] == beat else (None, None)
+        if handler is None:
+            logger.warning(f"Цикл событий был заблокирован на {lag:.2f} с (источник не пойман)")
+        elif handler == location:
+            logger.warning(f"Цикл событий был заблокирован на {lag:.2f} с: {handler}")
+        else:
+            logger.warning(f"Цикл событий был заблокирован на {lag:.2f} с: {handler}, строка {location}")
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            beat = self._last_beat
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            if self._culprit is not None and self._culprit[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._culprit = (beat, *blocking_call_site(frame))
@@ -1,4 +1,5 @@
 import asyncio
+import importlib
 import sys
 import logging
 from pathlib import Path
@@ -9,35 +10,82 @@ logger = logging.getLogger(__name__)
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 
+# Модули разбора тяжелые (lxml, rarfile), поэтому грузятся в фоне уже после старта опроса
+PARSING_MODULES = ('src.archive_handler', 'src.fb2_merger')
+
+def preload_parsing_modules():
+    for module_name in PARSING_MODULES:
+        importlib.import_module(module_name)
+
 async def main():
     try:
         from config.config import Config
-        from src.bot import router, bot_data
+        from src.bot import router, bot_data, create_status_message, get_main_inline_keyboard, get_workspace
         from aiogram import Bot, Dispatcher
         from aiogram.fsm.storage.memory import MemoryStorage
         
+        Config.validate()
         config = Config()
         bot_data.config = config
         
+        from src.send_queue import SendQueue
+        
         bot = Bot(token=config.BOT_TOKEN)
+        send_queue = SendQueue(
+            global_rate=config.TELEGRAM_GLOBAL_RATE,
+            chat_rate=config.TELEGRAM_CHAT_RATE,
+            chat_burst=config.TELEGRAM_CHAT_BURST,
+            max_retries=config.TELEGRAM_MAX_RETRIES
+        )
+        bot.session.middleware(send_queue)
+        bot_data.send_queue = send_queue
         bot_data.config.bot = bot
         bot_data.bot_instance = bot
         
         storage = MemoryStorage()
         dp = Dispatcher(storage=storage)
         
-        from src.archive_handler import ArchiveHandler
-        from src.fb2_merger import FB2Merger
+        from src.status_updater import StatusUpdater
+        from src.workers import configure_workers
         
-        bot_data.archive_handler = ArchiveHandler(use_file_storage=True)
-        bot_data.merger = FB2Merger(max_memory_mb=2048)
+        configure_workers(config.PARSE_WORKERS, config.ARCHIVE_WORKERS, config.EXTRACT_WORKERS, config.IO_WORKERS,
+                          config.STREAM_WORKERS, config.MERGE_WORKERS)
+        bot_data.status_updater = StatusUpdater(
+            bot,
+            bot_data.sessions,
+            create_status_message,
+            get_main_inline_keyboard,
+            delay=config.STATUS_DEBOUNCE_SECONDS,
+            min_interval=config.STATUS_MIN_INTERVAL_SECONDS
+        )
         
+        # Время каждого обработчика попадает в гистограммы, которые показывает /stats
+        from src.metrics import HandlerTimingMiddleware
+        timing = HandlerTimingMiddleware(bot_data.metrics)
+        dp.message.middleware(timing)
+        dp.callback_query.middleware(timing)
         dp.include_router(router)
         
+        # Остатки прошлого запуска уходят в корзину до приёма первых файлов
+        workspace = get_workspace()
+        await workspace.reconcile()
+        
         print("🤖 BookMergeBot запущен!")
         print("📁 Отправляйте архивы с FB2")
         
-        await dp.start_polling(bot)
+        asyncio.get_running_loop().run_in_executor(None, preload_parsing_modules)
+        
+        # Обработчик, задержавший цикл событий дольше порога, попадает в лог
+        from src.loop_monitor import LoopLagMonitor
+        loop_monitor = LoopLagMonitor(config.LOOP_LAG_THRESHOLD, histogram=bot_data.metrics.loop_lag)
+        loop_monitor.start()
+        bot_data.loop_monitor = loop_monitor
+        
+        try:
+            await dp.start_polling(bot)
+        finally:
+            await loop_monitor.stop()
+            await workspace.drain()
         
     except Exception as e:
         logger.error(f"Ошибка: {e}")
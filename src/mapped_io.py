@@ -0,0 +1,86 @@
+import io
+import mmap
+import os
+from typing import BinaryIO, Optional, Union
+
+from src.encoding import SAMPLE_SIZE
+
+MMAP_THRESHOLD = 1024 * 1024
+FEED_CHUNK_SIZE = 1024 * 1024
+
+
+class _MappedReader(io.RawIOBase):
+    def __init__(self, buffer: mmap.mmap):
+        self._buffer = buffer
+        self._buffer.seek(0)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._buffer.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._buffer.seek(offset, whence)
+        return self._buffer.tell()
+
+    def tell(self) -> int:
+        return self._buffer.tell()
+
+
+class MappedFile:
+    # Принимает путь или уже открытый файл на диске (например, переполненный SpooledTemporaryFile);
+    # чужой файл не закрывается
+    def __init__(self, source: Union[str, os.PathLike, BinaryIO], threshold: int = MMAP_THRESHOLD):
+        self.source = source
+        self.threshold = threshold
+        self.size = 0
+        self.buffer: Union[mmap.mmap, bytes] = b""
+        self._file: Optional[BinaryIO] = None
+        self._owned = isinstance(source, (str, os.PathLike))
+
+    def __enter__(self) -> 'MappedFile':
+        if self._owned:
+            self._file = open(self.source, 'rb')
+        else:
+            # Буфер записи чужого файла должен дойти до диска, иначе хвост не попадёт в отображение
+            self._file = self.source
+            self._file.flush()
+        self.size = os.fstat(self._file.fileno()).st_size
+
+        if self.size >= self.threshold:
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._file.seek(0)
+            self.buffer = self._file.read()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.buffer = b""
+        if self._file and self._owned:
+            self._file.close()
+        self._file = None
+
+    def prefix(self, size: int = SAMPLE_SIZE) -> bytes:
+        return bytes(self.buffer[:size])
+
+    def fileobj(self) -> BinaryIO:
+        if isinstance(self.buffer, mmap.mmap):
+            return _MappedReader(self.buffer)
+        return io.BytesIO(self.buffer)
+
+
+def feed_parser(parser, buffer, chunk_size: int = FEED_CHUNK_SIZE):
+    if isinstance(buffer, bytes):
+        parser.feed(buffer)
+        return parser.close()
+    for offset in range(0, len(buffer), chunk_size):
+        parser.feed(buffer[offset:offset + chunk_size])
+    return parser.close()
@@ -0,0 +1,116 @@
+import bisect
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+# Верхние границы корзин в секундах: от миллисекунды до минуты, примерно в 2-2.5 раза шире предыдущей
+BUCKET_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 60.0)
+
+
+class Histogram:
+    # Фиксированные корзины: запись - один bisect, память не растёт с числом замеров
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        # Оценка с линейной интерполяцией внутри корзины, не больше реального максимума
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKET_BOUNDS[index - 1] if index else 0.0
+                upper = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.handlers: Dict[str, Histogram] = {}
+        self.lock_wait = Histogram()
+        self.loop_lag = Histogram()
+        self.started = time.monotonic()
+
+    def handler(self, name: str) -> Histogram:
+        histogram = self.handlers.get(name)
+        if histogram is None:
+            histogram = self.handlers[name] = Histogram()
+        return histogram
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'uptime': time.monotonic() - self.started,
+            'handlers': {name: histogram.snapshot() for name, histogram in self.handlers.items()},
+            'lock_wait': self.lock_wait.snapshot(),
+            'loop_lag': self.loop_lag.snapshot(),
+        }
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    # Внутренний middleware: вызывается только для обновлений, нашедших обработчик, и знает его имя
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', None) or type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.metrics.handler(name).observe(time.perf_counter() - started)
+
+
+def _format_ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}" if seconds >= 0.01 else f"{seconds * 1000:.1f}"
+
+
+def _format_line(label: str, stats: Dict[str, float]) -> str:
+    return (f"{label}: {stats['count']} шт., p50 {_format_ms(stats['p50'])} / p95 {_format_ms(stats['p95'])} / "
+            f"p99 {_format_ms(stats['p99'])} / макс {_format_ms(stats['max'])} мс")
+
+
+def format_stats(metrics: Metrics, stalls: int = 0, send_stats: Optional[Dict[str, int]] = None) -> str:
+    snapshot = metrics.snapshot()
+    lines = [f"📊 Статистика за {snapshot['uptime'] / 3600:.1f} ч", "", "⏱ Обработчики:"]
+
+    handlers = sorted(snapshot['handlers'].items(), key=lambda item: item[1]['p95'], reverse=True)
+    if handlers:
+        lines.extend(_format_line(f"• {name}", stats) for name, stats in handlers)
+    else:
+        lines.append("• пока не вызывались")
+
+    lines.append("")
+    lines.append(_format_line("🔒 Ожидание блокировки", snapshot['lock_wait']))
+    lines.append(_format_line("🔁 Задержка цикла", snapshot['loop_lag']))
+    lines.append(f"⚠️ Остановок цикла выше порога: {stalls}")
+
+    if send_stats is not None:
+        lines.append(f"📤 Отправка: {send_stats['sent']} отправлено, {send_stats['retried']} повторов, "
+                     f"{send_stats['failed']} ошибок")
+    return "\n".join(lines)
@@ -1,41 +1,27 @@
+import asyncio
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
-import os
-from datetime import datetime
-import re
+from typing import List, Dict, Optional, Tuple
 
-@dataclass
+from src.spool import PayloadRef, Spool
+from src.fingerprint import FingerprintRegistry
+from src.book_metadata import BookMetadata
+from src.series import extract_base_series_name, get_unique_series_names, build_series_title
+
+@dataclass(slots=True)
 class FB2Image:
+    # Только описание картинки: сами байты лежат в сегменте книги
     id: str
     content_type: str
-    data: bytes
     original_ref: str
     actual_extension: str = ""
+    size: int = 0
     
     def get_size(self) -> int:
-        return len(self.data) if self.data else 0
+        return self.size
     
     def detect_extension(self) -> str:
         if self.actual_extension:
             return self.actual_extension
-            
-        if not self.data:
-            return ".jpg"
-        
-        if self.data.startswith(b'\xff\xd8'):
-            return ".jpg"
-        elif self.data.startswith(b'\x89PNG\r\n\x1a\n'):
-            return ".png"
-        elif self.data.startswith(b'GIF8'):
-            return ".gif"
-        elif self.data.startswith(b'BM'):
-            return ".bmp"
-        elif self.data.startswith(b'RIFF') and len(self.data) > 12 and self.data[8:12] == b'WEBP':
-            return ".webp"
-        elif self.data.startswith(b'II*\x00') or self.data.startswith(b'MM\x00*'):
-            return ".tiff"
-        elif self.data.startswith(b'\x00\x00\x01\x00'):
-            return ".ico"
         
         if 'jpeg' in self.content_type.lower() or 'jpg' in self.content_type.lower():
             return ".jpg"
@@ -70,33 +56,47 @@ class FB2Image:
         else:
             return self.content_type
 
-@dataclass
+@dataclass(slots=True, frozen=True)
+class BookSegment:
+    # Книга, готовая к склейке: её <section>, следом все её <binary>. Id внутри уже с префиксом
+    # token, поэтому сегмент не зависит ни от места книги в сборнике, ни от его названия
+    token: str
+    section_length: int
+    length: int
+    inline_data: Optional[bytes] = None
+    payload: Optional[PayloadRef] = None
+
+@dataclass(slots=True)
 class BookContent:
     content: str
     filename: str
     title: str = "Unknown"
     images: Dict[str, FB2Image] = field(default_factory=dict)
-    processed_content: str = ""
     sort_order: int = 0
     file_path: str = ""
+    segment: Optional[BookSegment] = None
+    similar_to: str = ""
+    metadata: Optional[BookMetadata] = None
+    # (серия, номер) для авто-сортировки, снимается при разборе
+    sort_key: Tuple[str, Optional[float]] = ("", None)
     
     def get_total_size(self) -> int:
+        # Картинки входят в сегмент, отдельно они не считаются
         content_size = len(self.content.encode('utf-8')) if self.content else 0
-        processed_size = len(self.processed_content.encode('utf-8')) if self.processed_content else 0
-        images_size = sum(img.get_size() for img in self.images.values())
-        return content_size + processed_size + images_size
-    
-    def load_content_from_file(self):
-        if not self.content and self.file_path and os.path.exists(self.file_path):
-            try:
-                with open(self.file_path, 'r', encoding='utf-8') as f:
-                    self.content = f.read()
-            except:
-                try:
-                    with open(self.file_path, 'r', encoding='cp1251') as f:
-                        self.content = f.read()
-                except:
-                    self.content = ""
+        segment_size = len(self.segment.inline_data) if self.segment and self.segment.inline_data is not None else 0
+        return content_size + segment_size
+
+@dataclass(slots=True, frozen=True)
+class SessionSnapshot:
+    # Неизменяемый срез для слияния: книги уже в нужном порядке, сессию можно менять дальше
+    books: Tuple[BookContent, ...]
+    series_title: str
+    spool: Optional[Spool]
+
+def _released_event() -> asyncio.Event:
+    event = asyncio.Event()
+    event.set()
+    return event
 
 @dataclass
 class UserSession:
@@ -105,7 +105,14 @@ class UserSession:
     temp_dirs: List[str] = field(default_factory=list)
     custom_series_title: str = ""
     status_message_id: Optional[int] = None
-    last_file_time: Optional[datetime] = None
+    pending_uploads: int = 0
+    books_revision: int = 0
+    merging: bool = False
+    spool: Optional[Spool] = field(default=None, repr=False, compare=False)
+    # Сброшено, пока снимок слияния читает спул: /clear ждёт его, прежде чем удалять файлы сессии
+    files_released: asyncio.Event = field(default_factory=_released_event, repr=False, compare=False)
+    fingerprints: FingerprintRegistry = field(default_factory=FingerprintRegistry, repr=False, compare=False)
+    _series_title_cache: Optional[Tuple[int, str]] = field(default=None, repr=False, compare=False)
     
     def get_memory_usage(self) -> int:
         return sum(book.get_total_size() for book in self.book_contents)
@@ -116,78 +123,59 @@ class UserSession:
     def get_sorted_books(self) -> list[BookContent]:
         return sorted(self.book_contents, key=lambda x: x.sort_order)
     
-    def _extract_base_series_name(self, title: str) -> str:
-        patterns_to_remove = [
-            r'(книга|том|часть|глава|серия|часть)\s*\d+[\.,]?.*',
-            r'\d+[\.,]?\s*.*',
-            r'\(.*?\)',
-            r'\[.*?\]',
-        ]
-        
-        clean_title = title
-        for pattern in patterns_to_remove:
-            clean_title = re.sub(pattern, '', clean_title, flags=re.IGNORECASE)
-        
-        separators = ['\.', ':', '-', '–', '—']
-        for sep in separators:
-            if re.search(sep, clean_title):
-                parts = re.split(sep, clean_title, 1)
-                if parts[0].strip():
-                    clean_title = parts[0].strip()
-                    break
+    def snapshot(self) -> SessionSnapshot:
+        self.files_released.clear()
+        return SessionSnapshot(
+            books=tuple(self.get_sorted_books()),
+            series_title=self.get_series_title(),
+            spool=self.spool
+        )
+    
+    def release_snapshot(self):
+        self.files_released.set()
+    
+    def add_books(self, books: List[BookContent]):
+        start_order = len(self.book_contents)
+        for i, book in enumerate(books):
+            book.sort_order = start_order + i
+            self.book_contents.append(book)
+        self.books_revision += 1
+    
+    def set_book_order(self, books: List[BookContent]):
+        self.book_contents = list(books)
+        for i, book in enumerate(self.book_contents):
+            book.sort_order = i
+        self.books_revision += 1
+    
+    def auto_sort(self) -> bool:
+        # Порядок строится по ключам, снятым при разборе: серии идут в порядке первого появления,
+        # внутри серии - по номеру, книги без номера - в конце серии в порядке загрузки
+        books = self.get_sorted_books()
+        groups: Dict[str, int] = {}
+        for book in books:
+            groups.setdefault(book.sort_key[0], len(groups))
         
-        if len(clean_title.strip()) < 3:
-            match = re.match(r'^(.*?)\d', title)
-            if match:
-                clean_title = match.group(1).strip(' .-')
-            elif '.' in title:
-                clean_title = title.split('.')[0].strip()
-            elif ':' in title:
-                clean_title = title.split(':')[0].strip()
-            else:
-                words = title.split()
-                clean_title = ' '.join(words[:2]) if len(words) >= 2 else title
+        ordered = sorted(books, key=lambda book: (
+            groups[book.sort_key[0]], book.sort_key[1] is None, book.sort_key[1] or 0
+        ))
+        if all(a is b for a, b in zip(ordered, books)):
+            return False
         
-        return clean_title.strip()
+        self.set_book_order(ordered)
+        return True
+    
+    def _extract_base_series_name(self, title: str) -> str:
+        return extract_base_series_name(title)
     
     def _get_unique_series_names(self) -> List[str]:
-        series_names = []
-        seen = set()
-        
-        for book in self.book_contents:
-            series_name = self._extract_base_series_name(book.title)
-            normalized = series_name.lower()
-            
-            is_substring = False
-            for existing in list(seen):
-                if normalized in existing or existing in normalized:
-                    if len(normalized) < len(existing):
-                        seen.remove(existing)
-                        series_names = [s for s in series_names if s.lower() != existing]
-                    else:
-                        is_substring = True
-                        break
-            
-            if not is_substring and normalized not in seen:
-                seen.add(normalized)
-                series_names.append(series_name)
-        
-        return series_names
+        return get_unique_series_names(book.title for book in self.book_contents)
     
     def get_series_title(self) -> str:
         if self.custom_series_title:
             return self.custom_series_title
         
-        series_names = self._get_unique_series_names()
+        if self._series_title_cache is None or self._series_title_cache[0] != self.books_revision:
+            titles = [book.title for book in self.book_contents]
+            self._series_title_cache = (self.books_revision, build_series_title(titles))
         
-        if not series_names:
-            return "Объединенные книги"
-        
-        if len(series_names) == 1:
-            return series_names[0]
-        
-        if len(series_names) > 3:
-            main_series = series_names[:3]
-            return f"{', '.join(main_series)}, ..."
-        else:
-            return ', '.join(series_names)
\ No newline at end of file
+        return self._series_title_cache[1]
@@ -0,0 +1,94 @@
+import base64
+import itertools
+from typing import Dict, Iterable, Optional
+
+from lxml import etree
+
+from src.book_metadata import BookMetadata
+from src.models import BookSegment, FB2Image
+from src.spool import Spool
+from src.xml_parsers import parse_fragment
+
+FB2_NS = 'http://www.gribuser.ru/xml/fictionbook/2.0'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+FB2_NSMAP = {None: FB2_NS, 'xlink': XLINK_NS}
+
+# Префиксы id книг уникальны в пределах процесса, как и сами сессии
+_segment_tokens = itertools.count(1)
+
+
+def _fb(tag: str) -> str:
+    return f'{{{FB2_NS}}}{tag}'
+
+
+def new_segment_token() -> str:
+    return f"b{next(_segment_tokens)}"
+
+
+def build_book_section(title: str, metadata: Optional[BookMetadata], elements: Iterable) -> etree._Element:
+    book_section = etree.Element(_fb('section'), nsmap=FB2_NSMAP)
+    book_section.extend(elements)
+    return dress_book_section(book_section, title, metadata)
+
+
+def dress_book_section(book_section, title: str, metadata: Optional[BookMetadata]) -> etree._Element:
+    # Заголовок книги берётся из метаданных, аннотация - из title-info
+    title_elem = etree.Element(_fb('title'))
+    etree.SubElement(title_elem, _fb('p')).text = title
+    book_section.insert(0, title_elem)
+
+    if len(book_section) == 1:
+        etree.SubElement(book_section, _fb('p')).text = f"[Содержимое книги '{title}' отсутствует]"
+
+    _insert_annotation(book_section, metadata)
+    return book_section
+
+
+def _insert_annotation(book_section, metadata: Optional[BookMetadata]):
+    if metadata is None or not metadata.annotation:
+        return
+
+    try:
+        annotation = etree.Element(_fb('annotation'))
+        annotation.extend(parse_fragment(metadata.annotation))
+    except Exception:
+        return
+
+    # По схеме FB2 аннотация секции идёт после заголовка, эпиграфов и картинки
+    position = 1
+    while position < len(book_section) and book_section[position].tag in (_fb('epigraph'), _fb('image')):
+        position += 1
+    book_section.insert(position, annotation)
+
+
+def build_binary(image_id: str, image: FB2Image, data: bytes):
+    try:
+        binary_elem = etree.Element(_fb('binary'), nsmap=FB2_NSMAP)
+        binary_elem.set('id', image_id)
+        binary_elem.set('content-type', image.get_correct_content_type())
+        binary_elem.text = base64.b64encode(data).decode('utf-8')
+        return binary_elem
+    except Exception:
+        return None
+
+
+def render_segment(book_section, images: Dict[str, FB2Image], image_data: Dict[str, bytes], token: str,
+                   spool: Optional[Spool] = None) -> BookSegment:
+    # Ссылки в book_section уже должны указывать на id вида {token}_{исходный id};
+    # байты картинок нужны только здесь и дальше живут лишь внутри сегмента
+    section = etree.tostring(book_section, encoding='utf-8', pretty_print=True)
+
+    binaries = []
+    for image_id, image in images.items():
+        binary_elem = build_binary(f"{token}_{image_id}", image, image_data[image_id])
+        if binary_elem is not None:
+            binaries.append(etree.tostring(binary_elem, encoding='utf-8', pretty_print=True))
+
+    data = section + b"".join(binaries)
+    return BookSegment(
+        token=token,
+        section_length=len(section),
+        length=len(data),
+        inline_data=None if spool else data,
+        payload=spool.put(data) if spool else None
+    )
@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter, TelegramServerError
+from aiogram.methods import (
+    TelegramMethod, SendDocument, SendMessage, EditMessageText, DeleteMessage
+)
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_DOCUMENT = 0
+PRIORITY_MESSAGE = 1
+PRIORITY_EDIT = 2
+PRIORITY_DELETE = 3
+
+
+def get_method_priority(method: TelegramMethod) -> int:
+    if isinstance(method, SendDocument):
+        return PRIORITY_DOCUMENT
+    if isinstance(method, SendMessage):
+        return PRIORITY_MESSAGE
+    if isinstance(method, EditMessageText):
+        return PRIORITY_EDIT
+    if isinstance(method, DeleteMessage):
+        return PRIORITY_DELETE
+    return PRIORITY_MESSAGE
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated: Optional[float] = None
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = 0.0
+
+
+class _Job:
+    def __init__(self, priority: int, seq: int, chat_id: Any, bot: Bot,
+                 method: TelegramMethod, make_request: NextRequestMiddlewareType,
+                 future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.bot = bot
+        self.method = method
+        self.make_request = make_request
+        self.future = future
+        self.attempts = 0
+
+    def __lt__(self, other: '_Job') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendQueue(BaseRequestMiddleware):
+    def __init__(self, global_rate: float = 25.0, chat_rate: float = 1.0,
+                 chat_burst: float = 3.0, max_retries: int = 5):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._busy_chats: Set[Any] = set()
+        self._heap: List[_Job] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot,
+                       method: TelegramMethod) -> Any:
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        loop = asyncio.get_running_loop()
+        job = _Job(
+            get_method_priority(method), next(self._seq), chat_id,
+            bot, method, make_request, loop.create_future()
+        )
+        heapq.heappush(self._heap, job)
+        self._ensure_dispatcher()
+        return await job.future
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    async def close(self):
+        if self._dispatcher and not self._dispatcher.done():
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        self._dispatcher = None
+
+    def _ensure_dispatcher(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _sleep(self, timeout: Optional[float]):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _pick(self, now: float) -> Tuple[Optional[_Job], Optional[float]]:
+        min_wait = None
+        for job in sorted(self._heap):
+            if job.future.done():
+                continue
+            if job.chat_id in self._busy_chats:
+                continue
+            wait = self._chat_bucket(job.chat_id).wait_time(now)
+            if wait <= 0:
+                return job, None
+            if min_wait is None or wait < min_wait:
+                min_wait = wait
+        return None, min_wait
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._heap = [job for job in self._heap if not job.future.done()]
+            heapq.heapify(self._heap)
+
+            if not self._heap:
+                await self._sleep(None)
+                continue
+
+            now = loop.time()
+            wait = self.global_bucket.wait_time(now)
+            if wait > 0:
+                await self._sleep(wait)
+                continue
+
+            job, wait = self._pick(now)
+            if job is None:
+                await self._sleep(wait)
+                continue
+
+            self._heap.remove(job)
+            heapq.heapify(self._heap)
+            self.global_bucket.consume(now)
+            self._chat_bucket(job.chat_id).consume(now)
+            self._busy_chats.add(job.chat_id)
+            asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: _Job):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            self._retry(job, loop.time() + e.retry_after, e)
+        except TelegramServerError as e:
+            self._retry(job, loop.time() + min(2 ** job.attempts, 30), e)
+        except Exception as e:
+            self.stats['failed'] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.stats['sent'] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._busy_chats.discard(job.chat_id)
+            self._wakeup.set()
+
+    def _retry(self, job: _Job, until: float, error: Exception):
+        job.attempts += 1
+        if job.attempts > self.max_retries or job.future.done():
+            self.stats['failed'] += 1
+            logger.warning(f"Запрос {type(job.method).__name__} в чат {job.chat_id} не доставлен: {error}")
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+
+        self.stats['retried'] += 1
+        self._chat_bucket(job.chat_id).block(until)
+        heapq.heappush(self._heap, job)
@@ -0,0 +1,114 @@
+import bisect
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_SERIES_TITLE = "Объединенные книги"
+
+_PATTERNS_TO_REMOVE = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'(книга|том|часть|глава|серия|часть)\s*\d+[\.,]?.*',
+        r'\d+[\.,]?\s*.*',
+        r'\(.*?\)',
+        r'\[.*?\]',
+    )
+]
+_SEPARATORS = [re.compile(sep) for sep in (r'\.', ':', '-', '–', '—')]
+_TEXT_BEFORE_DIGIT = re.compile(r'^(.*?)\d')
+_NUMBER = re.compile(r'\d+(?:[.,]\d+)?')
+
+
+@lru_cache(maxsize=4096)
+def extract_base_series_name(title: str) -> str:
+    clean_title = title
+    for pattern in _PATTERNS_TO_REMOVE:
+        clean_title = pattern.sub('', clean_title)
+
+    for sep in _SEPARATORS:
+        if sep.search(clean_title):
+            parts = sep.split(clean_title, 1)
+            if parts[0].strip():
+                clean_title = parts[0].strip()
+                break
+
+    if len(clean_title.strip()) < 3:
+        match = _TEXT_BEFORE_DIGIT.match(title)
+        if match:
+            clean_title = match.group(1).strip(' .-')
+        elif '.' in title:
+            clean_title = title.split('.')[0].strip()
+        elif ':' in title:
+            clean_title = title.split(':')[0].strip()
+        else:
+            words = title.split()
+            clean_title = ' '.join(words[:2]) if len(words) >= 2 else title
+
+    return clean_title.strip()
+
+
+class SeriesNameIndex:
+    # Ключи хранятся отсортированными и без префиксов друг друга: более короткое
+    # название серии поглощает все длинные, которые с него начинаются
+    def __init__(self):
+        self._names: Dict[str, str] = {}
+        self._keys: List[str] = []
+
+    def add(self, series_name: str):
+        normalized = series_name.lower()
+        if not normalized or normalized in self._names:
+            return
+
+        for end in range(1, len(normalized)):
+            if normalized[:end] in self._names:
+                return
+
+        start = bisect.bisect_left(self._keys, normalized)
+        end = start
+        while end < len(self._keys) and self._keys[end].startswith(normalized):
+            del self._names[self._keys[end]]
+            end += 1
+
+        self._keys[start:end] = [normalized]
+        self._names[normalized] = series_name
+
+    def names(self) -> List[str]:
+        return list(self._names.values())
+
+
+def get_unique_series_names(titles: Iterable[str]) -> List[str]:
+    index = SeriesNameIndex()
+    for title in titles:
+        index.add(extract_base_series_name(title))
+    return index.names()
+
+
+def build_series_title(titles: Iterable[str]) -> str:
+    series_names = get_unique_series_names(titles)
+
+    if not series_names:
+        return DEFAULT_SERIES_TITLE
+
+    if len(series_names) == 1:
+        return series_names[0]
+
+    if len(series_names) > 3:
+        main_series = series_names[:3]
+        return f"{', '.join(main_series)}, ..."
+    else:
+        return ', '.join(series_names)
+
+
+def parse_number(text: str) -> Optional[float]:
+    match = _NUMBER.search(text or "")
+    if not match:
+        return None
+    return float(match.group().replace(',', '.'))
+
+
+def book_sort_key(title: str, sequence_name: str = "", sequence_number: str = "") -> Tuple[str, Optional[float]]:
+    # Серия из <sequence>, а без неё - из названия; номер из <sequence number=>, иначе первое число в названии
+    group = ' '.join((sequence_name or extract_base_series_name(title)).lower().split())
+    number = parse_number(sequence_number)
+    if number is None:
+        number = parse_number(title)
+    return group, number
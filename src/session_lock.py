@@ -0,0 +1,71 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional, Set
+
+from src.metrics import Histogram
+
+
+class SessionLock:
+    # Блокировка сессии пользователя: чтение (список, меню сортировки, снимок для слияния)
+    # идёт параллельно, изменение - в одиночку. Ждущий писатель не пропускает вперёд новых
+    # читателей, иначе поток просмотров списка мог бы бесконечно откладывать загрузку.
+    # Освобождение синхронное, поэтому отмена задачи не может оставить блокировку занятой
+    def __init__(self, wait_histogram: Optional[Histogram] = None):
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self._waiters: Set[asyncio.Future] = set()
+        self._wait_histogram = wait_histogram
+
+    @property
+    def readers(self) -> int:
+        return self._readers
+
+    def locked(self) -> bool:
+        return self._writer or self._readers > 0
+
+    async def _wait_until(self, ready: Callable[[], bool]):
+        started = time.perf_counter()
+        while not ready():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.add(waiter)
+            try:
+                await waiter
+            finally:
+                self._waiters.discard(waiter)
+        if self._wait_histogram is not None:
+            self._wait_histogram.observe(time.perf_counter() - started)
+
+    def _wake(self):
+        # Ждущих на одного пользователя единицы, каждый сам перепроверяет своё условие
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[None]:
+        await self._wait_until(lambda: not self._writer and not self._waiting_writers)
+        self._readers += 1
+        try:
+            yield
+        finally:
+            self._readers -= 1
+            if not self._readers:
+                self._wake()
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[None]:
+        self._waiting_writers += 1
+        try:
+            await self._wait_until(lambda: not self._writer and not self._readers)
+        finally:
+            self._waiting_writers -= 1
+            # Отменённый писатель больше не должен задерживать читателей
+            self._wake()
+        self._writer = True
+        try:
+            yield
+        finally:
+            self._writer = False
+            self._wake()
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional
+
+
+@dataclass(slots=True, frozen=True)
+class PayloadRef:
+    path: str
+    offset: int
+    length: int
+    digest: str
+
+    def read(self) -> bytes:
+        with open(self.path, 'rb') as f:
+            return os.pread(f.fileno(), self.length, self.offset)
+
+
+class SpoolClosedError(Exception):
+    pass
+
+
+class Spool:
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.path: Optional[Path] = None
+        self.size = 0
+        self._file: Optional[BinaryIO] = None
+        self._digests: Dict[str, PayloadRef] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="payloads-", suffix=".bin", dir=self.directory)
+        self._file = os.fdopen(fd, 'wb')
+        self.path = Path(path)
+
+    def put(self, data: bytes) -> PayloadRef:
+        digest = hashlib.sha1(data).hexdigest()
+
+        # Пишут несколько потоков разбора, одинаковые вложения хранятся один раз
+        with self._lock:
+            # После /clear папка сессии уже в корзине: разбор, который ещё идёт, не должен
+            # создавать её заново с файлом, на который никто не ссылается
+            if self._closed:
+                raise SpoolClosedError("Сессия очищена, загрузка отменена")
+
+            ref = self._digests.get(digest)
+            if ref is not None:
+                return ref
+
+            if self._file is None:
+                self._open()
+
+            offset = self.size
+            self._file.write(data)
+            self._file.flush()
+            self.size += len(data)
+
+            ref = PayloadRef(str(self.path), offset, len(data), digest)
+            self._digests[digest] = ref
+            return ref
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _StatusState:
+    chat_id: int
+    dirty: bool = False
+    move_to_bottom: bool = False
+    last_text: str = ""
+    last_flush: float = 0.0
+    task: Optional[asyncio.Task] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class StatusUpdater:
+    def __init__(self, bot: Bot, sessions: Dict[int, 'UserSession'],
+                 render: Callable[['UserSession'], str],
+                 markup: Callable[[], InlineKeyboardMarkup],
+                 delay: float = 1.5, min_interval: float = 3.0):
+        self.bot = bot
+        self.sessions = sessions
+        self.render = render
+        self.markup = markup
+        self.delay = delay
+        self.min_interval = min_interval
+        self._states: Dict[int, _StatusState] = {}
+
+    def _get_state(self, user_id: int, chat_id: int) -> _StatusState:
+        state = self._states.get(user_id)
+        if state is None:
+            state = _StatusState(chat_id=chat_id)
+            self._states[user_id] = state
+        state.chat_id = chat_id
+        return state
+
+    def schedule(self, user_id: int, chat_id: int, move_to_bottom: bool = False):
+        state = self._get_state(user_id, chat_id)
+        state.dirty = True
+        state.move_to_bottom = state.move_to_bottom or move_to_bottom
+
+        if state.task is None or state.task.done():
+            state.task = asyncio.create_task(self._run(user_id, state))
+
+    async def refresh(self, user_id: int, chat_id: int, move_to_bottom: bool = False):
+        state = self._get_state(user_id, chat_id)
+        state.dirty = True
+        state.move_to_bottom = state.move_to_bottom or move_to_bottom
+        await self._flush(user_id, state)
+
+    def forget(self, user_id: int):
+        state = self._states.pop(user_id, None)
+        if state and state.task and not state.task.done():
+            state.task.cancel()
+
+    async def _run(self, user_id: int, state: _StatusState):
+        loop = asyncio.get_running_loop()
+        try:
+            # Запросы, пришедшие за время ожидания, сливаются в одно обновление
+            while state.dirty and self._states.get(user_id) is state:
+                wait = max(self.delay, state.last_flush + self.min_interval - loop.time())
+                await asyncio.sleep(wait)
+                await self._flush(user_id, state)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Не удалось обновить статус для {user_id}: {e}")
+
+    async def _flush(self, user_id: int, state: _StatusState):
+        async with state.lock:
+            session = self.sessions.get(user_id)
+            if not state.dirty or session is None:
+                return
+
+            move_to_bottom = state.move_to_bottom
+            state.dirty = False
+            state.move_to_bottom = False
+            state.last_flush = asyncio.get_running_loop().time()
+
+            if not session.book_contents and not session.pending_uploads:
+                await self._delete(state.chat_id, session)
+                state.last_text = ""
+                return
+
+            text = self.render(session)
+
+            if session.status_message_id and not move_to_bottom:
+                if text == state.last_text:
+                    return
+                try:
+                    await self.bot.edit_message_text(
+                        chat_id=state.chat_id,
+                        message_id=session.status_message_id,
+                        text=text,
+                        reply_markup=self.markup()
+                    )
+                    state.last_text = text
+                    return
+                except TelegramBadRequest as e:
+                    if "message is not modified" in str(e):
+                        state.last_text = text
+                        return
+                except Exception:
+                    pass
+
+            await self._delete(state.chat_id, session)
+
+            try:
+                msg = await self.bot.send_message(
+                    chat_id=state.chat_id,
+                    text=text,
+                    reply_markup=self.markup()
+                )
+                session.status_message_id = msg.message_id
+                state.last_text = text
+            except Exception as e:
+                state.last_text = ""
+                logger.warning(f"Не удалось отправить статус для {user_id}: {e}")
+
+    async def _delete(self, chat_id: int, session: 'UserSession'):
+        if not session.status_message_id:
+            return
+        try:
+            await self.bot.delete_message(
+                chat_id=chat_id,
+                message_id=session.status_message_id
+            )
+        except Exception:
+            pass
+        finally:
+            session.status_message_id = None
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+PARSE_THREAD_PREFIX = "fb2-parse"
+ARCHIVE_THREAD_PREFIX = "archive-walk"
+EXTRACT_THREAD_PREFIX = "archive-extract"
+IO_THREAD_PREFIX = "fs-io"
+STREAM_THREAD_PREFIX = "upload-stream"
+MERGE_THREAD_PREFIX = "fb2-merge"
+
+_parse_workers: Optional[int] = None
+_archive_workers: Optional[int] = None
+_extract_workers: Optional[int] = None
+_io_workers: Optional[int] = None
+_stream_workers: Optional[int] = None
+_merge_workers: Optional[int] = None
+_parse_executor: Optional[ThreadPoolExecutor] = None
+_archive_executor: Optional[ThreadPoolExecutor] = None
+_extract_executor: Optional[ThreadPoolExecutor] = None
+_io_executor: Optional[ThreadPoolExecutor] = None
+_stream_executor: Optional[ThreadPoolExecutor] = None
+_merge_executor: Optional[ThreadPoolExecutor] = None
+
+
+def configure_workers(parse_workers: Optional[int] = None, archive_workers: Optional[int] = None,
+                      extract_workers: Optional[int] = None, io_workers: Optional[int] = None,
+                      stream_workers: Optional[int] = None, merge_workers: Optional[int] = None):
+    global _parse_workers, _archive_workers, _extract_workers, _io_workers, _stream_workers, _merge_workers
+    _parse_workers = parse_workers
+    _archive_workers = archive_workers
+    _extract_workers = extract_workers
+    _io_workers = io_workers
+    _stream_workers = stream_workers
+    _merge_workers = merge_workers
+
+
+def parse_worker_count() -> int:
+    return _parse_workers or os.cpu_count() or 2
+
+
+def get_parse_executor() -> ThreadPoolExecutor:
+    global _parse_executor
+    if _parse_executor is None:
+        # lxml отпускает GIL во время разбора, поэтому потоки работают параллельно
+        _parse_executor = ThreadPoolExecutor(max_workers=parse_worker_count(), thread_name_prefix=PARSE_THREAD_PREFIX)
+    return _parse_executor
+
+
+def get_archive_executor() -> ThreadPoolExecutor:
+    global _archive_executor
+    if _archive_executor is None:
+        # Обход архива в основном ждёт распаковки и раздаёт книги пулу разбора
+        max_workers = _archive_workers or 4
+        _archive_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=ARCHIVE_THREAD_PREFIX)
+    return _archive_executor
+
+
+def extract_worker_count() -> int:
+    return _extract_workers or 4
+
+
+def get_extract_executor() -> ThreadPoolExecutor:
+    global _extract_executor
+    if _extract_executor is None:
+        # Потоки только ждут внешние распаковщики (unrar), число процессов ограничено размером пула
+        _extract_executor = ThreadPoolExecutor(max_workers=extract_worker_count(),
+                                               thread_name_prefix=EXTRACT_THREAD_PREFIX)
+    return _extract_executor
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    global _io_executor
+    if _io_executor is None:
+        # Файловые операции и сборка результата: отдельный пул, чтобы очистка большой сессии
+        # не ждала, пока освободятся потоки разбора, и наоборот
+        _io_executor = ThreadPoolExecutor(max_workers=_io_workers or 4, thread_name_prefix=IO_THREAD_PREFIX)
+    return _io_executor
+
+
+def get_stream_executor() -> ThreadPoolExecutor:
+    global _stream_executor
+    if _stream_executor is None:
+        # Разбор, который ждёт куски загрузки из сети: медленные загрузки держат эти потоки,
+        # а не потоки разбора, размер которых равен числу ядер
+        _stream_executor = ThreadPoolExecutor(max_workers=_stream_workers or 16,
+                                              thread_name_prefix=STREAM_THREAD_PREFIX)
+    return _stream_executor
+
+
+def get_merge_executor() -> ThreadPoolExecutor:
+    global _merge_executor
+    if _merge_executor is None:
+        # Сборка сборника пишет сотни мегабайт и идёт секундами: в общем файловом пуле
+        # несколько слияний заняли бы все потоки, и очистка с удалением файлов встала бы за ними
+        _merge_executor = ThreadPoolExecutor(max_workers=_merge_workers or 2, thread_name_prefix=MERGE_THREAD_PREFIX)
+    return _merge_executor
+
+
+def is_parse_worker() -> bool:
+    return threading.current_thread().name.startswith(PARSE_THREAD_PREFIX)
+
+
+async def run_in_parse_pool(func: Callable[..., Any], *args) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_parse_executor(), func, *args)
+
+
+async def run_in_archive_pool(func: Callable[..., Any], *args) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_archive_executor(), func, *args)
+
+
+async def run_in_stream_pool(func: Callable[..., Any], *args) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_stream_executor(), func, *args)
+
+
+async def run_in_io_pool(func: Callable[..., Any], *args) -> Any:
+    # Всё, что трогает диск, из обработчиков идёт сюда, а не выполняется в цикле событий
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), func, *args)
+
+
+async def run_in_merge_pool(func: Callable[..., Any], *args) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_merge_executor(), func, *args)
+
+
+def map_in_parse_pool(func: Callable[..., Any], jobs: Iterable[Tuple], max_inflight: int = 0) -> Iterator[Any]:
+    # Результаты отдаются в порядке заданий; число заданий в полёте ограничено,
+    # чтобы распакованные книги не копились в памяти быстрее, чем разбираются
+    if is_parse_worker():
+        # Ожидание своего же пула из его потока может занять все потоки и зависнуть
+        for args in jobs:
+            yield func(*args)
+        return
+
+    yield from _map_ordered(get_parse_executor(), func, jobs, max_inflight or parse_worker_count() * 2)
+
+
+def map_in_extract_pool(func: Callable[..., Any], jobs: Iterable[Tuple], max_inflight: int = 0) -> Iterator[Any]:
+    yield from _map_ordered(get_extract_executor(), func, jobs, max_inflight or extract_worker_count() * 2)
+
+
+def _map_ordered(executor: ThreadPoolExecutor, func: Callable[..., Any], jobs: Iterable[Tuple],
+                 max_inflight: int) -> Iterator[Any]:
+    pending = deque()
+    try:
+        for args in jobs:
+            pending.append(executor.submit(func, *args))
+            if len(pending) >= max_inflight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def shutdown_workers():
+    global _parse_executor, _archive_executor, _extract_executor, _io_executor, _stream_executor, _merge_executor
+    for executor in (_parse_executor, _archive_executor, _extract_executor, _io_executor, _stream_executor,
+                     _merge_executor):
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    _parse_executor = None
+    _archive_executor = None
+    _extract_executor = None
+    _io_executor = None
+    _stream_executor = None
+    _merge_executor = None
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+
+from src.workers import run_in_io_pool
+
+logger = logging.getLogger(__name__)
+
+TRASH_DIR_NAME = ".trash"
+SCRATCH_DIR_NAME = "scratch"
+MERGES_DIR_NAME = "merges"
+
+
+class WorkspaceQuotaError(Exception):
+    pass
+
+
+def disk_usage(path: Path) -> int:
+    # Место на диске (блоки, а не длина файлов) без перехода по симлинкам;
+    # файлы, удалённые во время обхода, просто пропускаются
+    total = 0
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_blocks * 512
+                    except FileNotFoundError:
+                        continue
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return total
+
+
+def _delete(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class WorkspaceManager:
+    # Все временные файлы бота живут под одним корнем:
+    #   <root>/<user_id>/ - данные сессии (спул, загрузки), удаляются по /clear
+    #   <root>/merges/    - собранные сборники до отправки; /clear их не трогает
+    #   <root>/scratch/   - временные копии архивов при обходе
+    #   <root>/.trash/    - то, что уже удаляется в фоне
+    def __init__(self, root: Path, max_bytes: int, user_max_bytes: int):
+        self.root = Path(root)
+        self.trash = self.root / TRASH_DIR_NAME
+        self.scratch = self.root / SCRATCH_DIR_NAME
+        self.merges = self.root / MERGES_DIR_NAME
+        self.max_bytes = max_bytes
+        self.user_max_bytes = user_max_bytes
+        self._reserved: Dict[int, int] = {}
+        self._deletions: Set[asyncio.Task] = set()
+
+    def user_dir(self, user_id: int) -> Path:
+        return self.root / str(user_id)
+
+    def merge_path(self, user_id: int) -> Path:
+        # Имя уникально: после /clear новое слияние может идти, пока отправляется старое
+        return self.merges / f"{user_id}-{uuid.uuid4().hex[:8]}.fb2"
+
+    async def reconcile(self) -> int:
+        # Сессии хранятся только в памяти, поэтому после перезапуска или падения всё под корнем -
+        # сироты. Переименование в корзину мгновенное, само удаление идёт в фоне
+        orphans = await run_in_io_pool(self._collect_orphans)
+        self._spawn_deletion(self.trash, keep_root=True)
+        if orphans:
+            logger.info(f"Рабочая папка: {orphans} осиротевших записей отправлено на удаление")
+        return orphans
+
+    def _collect_orphans(self) -> int:
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.trash.mkdir(exist_ok=True)
+
+        orphans = 0
+        for entry in self.root.iterdir():
+            if entry.name != TRASH_DIR_NAME and self._move_to_trash(entry) is not None:
+                orphans += 1
+
+        self.scratch.mkdir(exist_ok=True)
+        self.merges.mkdir(exist_ok=True)
+        return orphans
+
+    def _move_to_trash(self, path: Path) -> Optional[Path]:
+        target = self.trash / f"{path.name}-{uuid.uuid4().hex[:8]}"
+        try:
+            os.rename(path, target)
+            return target
+        except FileNotFoundError:
+            if not path.exists() or self.trash.exists():
+                return None
+            # Корзину удалили вручную уже после запуска
+            self.trash.mkdir(parents=True, exist_ok=True)
+            return self._move_to_trash(path)
+        except OSError:
+            # Не под корнем (другая ФС) - удаляется на месте
+            return path
+
+    async def remove(self, path: Path):
+        moved = await run_in_io_pool(self._move_to_trash, Path(path))
+        if moved is not None:
+            self._spawn_deletion(moved)
+
+    async def remove_user(self, user_id: int):
+        await self.remove(self.user_dir(user_id))
+
+    def _spawn_deletion(self, path: Path, keep_root: bool = False):
+        task = asyncio.get_running_loop().create_task(run_in_io_pool(self._purge, path, keep_root))
+        self._deletions.add(task)
+        task.add_done_callback(self._deletions.discard)
+
+    def _purge(self, path: Path, keep_root: bool):
+        if not keep_root:
+            _delete(path)
+            return
+        try:
+            for entry in path.iterdir():
+                _delete(entry)
+        except FileNotFoundError:
+            pass
+
+    def _usage(self, user_id: int) -> Tuple[int, int]:
+        return disk_usage(self.user_dir(user_id)), disk_usage(self.root)
+
+    @asynccontextmanager
+    async def reserve(self, user_id: int, size: int) -> AsyncIterator[None]:
+        # Место проверяется до загрузки; параллельные загрузки учитываются через резерв,
+        # пока их файлы ещё не появились на диске
+        user_used, total_used = await run_in_io_pool(self._usage, user_id)
+        user_reserved = self._reserved.get(user_id, 0)
+
+        if user_used + user_reserved + size > self.user_max_bytes:
+            raise WorkspaceQuotaError(
+                f"Недостаточно места: файлы сессии занимают {(user_used + user_reserved) / (1024 * 1024):.1f} МБ "
+                f"из {self.user_max_bytes / (1024 * 1024):.0f} МБ, файл весит {size / (1024 * 1024):.1f} МБ. "
+                f"Очистите сессию (/clear), чтобы освободить место."
+            )
+        if total_used + sum(self._reserved.values()) + size > self.max_bytes:
+            raise WorkspaceQuotaError("Сервер временно переполнен, попробуйте позже.")
+
+        self._reserved[user_id] = user_reserved + size
+        try:
+            yield
+        finally:
+            left = self._reserved.get(user_id, 0) - size
+            if left > 0:
+                self._reserved[user_id] = left
+            else:
+                self._reserved.pop(user_id, None)
+
+    async def drain(self):
+        if self._deletions:
+            await asyncio.gather(*self._deletions, return_exceptions=True)
@@ -0,0 +1,46 @@
+import threading
+from typing import Dict, Optional
+
+from lxml import etree
+
+# recover - битые FB2 встречаются постоянно; huge_tree - снимает лимиты libxml2 на глубину
+# и размер текстового узла (крупные binary); сущности, сеть, комментарии и PI не нужны.
+# remove_blank_text не включается: в смешанном содержимом (<p>a <strong>b</strong> <emphasis>c</emphasis></p>)
+# он выбрасывает пробелы между строчными элементами и склеивает слова
+PARSER_OPTIONS = dict(
+    recover=True,
+    huge_tree=True,
+    resolve_entities=False,
+    no_network=True,
+    load_dtd=False,
+    remove_comments=True,
+    remove_pis=True,
+    collect_ids=False,
+)
+
+_local = threading.local()
+
+
+def _parsers() -> Dict[Optional[str], etree.XMLParser]:
+    parsers = getattr(_local, 'parsers', None)
+    if parsers is None:
+        parsers = _local.parsers = {}
+    return parsers
+
+
+def get_parser(encoding: Optional[str] = None) -> etree.XMLParser:
+    # Парсер lxml нельзя делить между потоками, но внутри потока он переиспользуется
+    parsers = _parsers()
+    parser = parsers.get(encoding)
+    if parser is None:
+        parser = parsers[encoding] = etree.XMLParser(encoding=encoding, **PARSER_OPTIONS)
+    return parser
+
+
+def discard_parser(encoding: Optional[str] = None):
+    # После ошибки посреди feed() состояние парсера не гарантировано
+    _parsers().pop(encoding, None)
+
+
+def parse_fragment(content: str) -> etree._Element:
+    return etree.fromstring(f"<root>{content}</root>".encode('utf-8'), get_parser())